@@ -1,9 +1,13 @@
 import streamlit as st
-import geopandas as gpd
 import pandas as pd
 import plotly.express as px
 import altair as alt
 import plotly.graph_objects as go
+from utils.data import (
+    geometry_asset_url, load_desa_index, load_geometry_tier, load_population_by_year, load_population_long,
+)
+from utils.figures import cached_figure, show_figure_cache_stats
+from utils.population import desa_keys
 
 
 # Set page configuration
@@ -21,16 +25,24 @@ alt.themes.enable("dark")
 with open('style.css') as f:
     st.markdown(f'<style>{f.read()}</style>', unsafe_allow_html=True)
 
-# Memuat file GeoJSON
-geojson_file = 'andy.geojson'
-gdf_geojson = gpd.read_file(geojson_file)
+# Tingkat zoom peta, menentukan tingkat penyederhanaan geometri yang dikirim ke browser
+MAP_ZOOM = 8.5
+
+# Memuat file GeoJSON (di-cache sekali per proses server, disederhanakan untuk MAP_ZOOM)
+gdf_geojson = load_geometry_tier(MAP_ZOOM)
+
+# URL file GeoJSON statis yang diunduh browser sekali; None jika server tidak menyajikan file statis,
+# maka geometri disisipkan ke dalam gambar peta
+geometry_url = geometry_asset_url(MAP_ZOOM)
+
+# Data penduduk format panjang, diturunkan dari dataset utama (di-cache sekali per proses server)
+df_csv = load_population_long()
 
-# Memuat file CSV
-csv_file = 'AUDIT_data_kab.pwk.csv'
-df_csv = pd.read_csv(csv_file, index_col=0)
+# Tabel penduduk DESA x tahun, digabung ke geometri lewat (DESA_1, KECAMATAN) (geometri tidak diduplikasi per tahun)
+population_by_year = load_population_by_year()
 
-# Menggabungkan dataset berdasarkan DESA_1
-merged_df = gdf_geojson.merge(df_csv, how='left', left_on='DESA_1', right_on='DESA_1')
+# Penduduk per poligon dan tahun: DESA bernama sama dibedakan oleh kecamatannya
+population_by_polygon = population_by_year.reindex(desa_keys(gdf_geojson)).set_axis(gdf_geojson.index)
 
 # Mengubah bentuk DataFrame jika diperlukan
 df_reshaped = df_csv.groupby(['year', 'DESA_1']).agg({'population': 'sum'}).reset_index()
@@ -49,58 +61,127 @@ selected_year = st.sidebar.slider('Pilih Tahun', min_value=df_csv['year'].min(),
 color_theme_list = ['blues', 'cividis', 'greens', 'inferno', 'magma', 'plasma', 'reds', 'rainbow', 'turbo', 'viridis']
 selected_color_theme = st.sidebar.selectbox('Pilih tema warna', color_theme_list)
 
+# Mode animasi: semua tahun dikirim sekali sebagai frame peta, pergantian tahun di peta terjadi di browser tanpa rerun
+animate_years = st.sidebar.toggle('Animasi tahun pada peta')
 
-# Memfilter data untuk tahun yang dipilih
-filtered_df = merged_df[['DESA_1', 'geometry', 'year', 'population']].loc[merged_df['year'] == selected_year]
+
+# Data tahun yang dipilih: satu baris per poligon, tanpa kolom geometri
+filtered_df = pd.DataFrame({
+    'DESA_1': gdf_geojson['DESA_1'],
+    'year': selected_year,
+    'population': population_by_polygon[selected_year],
+}).dropna(subset=['population'])
 
 # Sidebar untuk pemilihan DESA_1
-selected_DESA = st.sidebar.selectbox('Pilih DESA', sorted(merged_df['DESA_1'].unique()))
+selected_DESA = st.sidebar.selectbox('Pilih DESA', sorted(gdf_geojson['DESA_1'].unique()))
 
-# Memfilter data untuk DESA yang dipilih
-filtered_df_DESA = filtered_df[filtered_df['DESA_1'] == selected_DESA]
+# Indeks centroid per DESA, dihitung sekali saat data dimuat
+desa_index = load_desa_index()
 
-# Menghitung pusat dan zoom berdasarkan bounding box geometri yang dipilih
-center_lat, center_lon = filtered_df.geometry.centroid.y.mean(), filtered_df.geometry.centroid.x.mean()
-zoom = 8.5  # Sesuaikan tingkat zoom
+# Pusat peta dari indeks
+center_lat, center_lon = desa_index['center']['lat'], desa_index['center']['lon']
+zoom = MAP_ZOOM  # Sesuaikan tingkat zoom
 # Ambil koordinat lon dan lat untuk DESA yang dipilih
-selected_lon = filtered_df_DESA.geometry.centroid.x.values[0]
-selected_lat = filtered_df_DESA.geometry.centroid.y.values[0]
-
-# Membuat peta interaktif menggunakan Plotly Express
-fig = px.choropleth_mapbox(
-    filtered_df,
-    geojson=filtered_df.geometry,
-    locations=filtered_df.index,
-    color='population',
-    hover_name='DESA_1',
-    mapbox_style="carto-darkmatter",
-    center={"lat": center_lat, "lon": center_lon},
-    zoom=zoom,
-    color_continuous_scale=selected_color_theme,
-    range_color=(min(filtered_df['population']), max(filtered_df['population']))
-)
+selected_lon = desa_index['desa'][selected_DESA]['lon']
+selected_lat = desa_index['desa'][selected_DESA]['lat']
+
+# Membangun peta interaktif tahun, tema dan DESA terpilih
+def build_map():
+    # Membuat peta interaktif menggunakan Plotly Express
+    fig = px.choropleth_mapbox(
+        filtered_df,
+        geojson=geometry_url or gdf_geojson.geometry,
+        locations=filtered_df.index,
+        color='population',
+        hover_name='DESA_1',
+        mapbox_style="carto-darkmatter",
+        center={"lat": center_lat, "lon": center_lon},
+        zoom=zoom,
+        color_continuous_scale=selected_color_theme,
+        range_color=(min(filtered_df['population']), max(filtered_df['population']))
+    )
 
-# Menambahkan marker untuk DESA yang dipilih
-fig.add_trace(go.Scattermapbox(
-    mode="markers+text",
-    lon=[selected_lon],
-    lat=[selected_lat],
-    marker=dict(size=14, color="red"),
-    text=[selected_DESA],
-    hoverinfo='text',
-    showlegend=False
-))
-
-
-
-# Menetapkan tata letak peta
-fig.update_layout(
-    template='plotly_dark',
-    plot_bgcolor='rgba(0, 0, 0, 0)',
-    paper_bgcolor='rgba(0, 0, 0, 0)',
-    margin=dict(l=0, r=0, t=0, b=0),
-    height=400  # Sesuaikan tinggi
-)
+    # Menambahkan marker untuk DESA yang dipilih
+    fig.add_trace(go.Scattermapbox(
+        mode="markers+text",
+        lon=[selected_lon],
+        lat=[selected_lat],
+        marker=dict(size=14, color="red"),
+        text=[selected_DESA],
+        hoverinfo='text',
+        showlegend=False
+    ))
+
+    # Menetapkan tata letak peta
+    fig.update_layout(
+        template='plotly_dark',
+        plot_bgcolor='rgba(0, 0, 0, 0)',
+        paper_bgcolor='rgba(0, 0, 0, 0)',
+        margin=dict(l=0, r=0, t=0, b=0),
+        height=400  # Sesuaikan tinggi
+    )
+    return fig
+
+
+# Peta beranimasi: peta tahun terpilih ditambah satu frame per tahun yang hanya berisi nilai penduduk,
+# dengan slider dan tombol putar plotly yang berjalan di browser
+def build_animated_map():
+    fig = build_map()
+
+    # Vektor penduduk semua tahun untuk poligon yang sama dengan peta tahun terpilih
+    fig.frames = [
+        go.Frame(name=str(year), data=[go.Choroplethmapbox(z=population_frames[year])], traces=[0])
+        for year in population_frames.columns
+    ]
+
+    # Rentang warna tetap untuk semua tahun agar warna antar frame dapat dibandingkan
+    frame_step = dict(mode='immediate', frame=dict(duration=0, redraw=True), transition=dict(duration=0))
+    fig.update_layout(
+        coloraxis=dict(cmin=population_frames.min().min(), cmax=population_frames.max().max()),
+        sliders=[dict(
+            active=list(population_frames.columns).index(selected_year),
+            currentvalue=dict(prefix='Tahun: '),
+            pad=dict(t=10),
+            steps=[
+                dict(label=str(year), method='animate', args=[[str(year)], frame_step])
+                for year in population_frames.columns
+            ],
+        )],
+        updatemenus=[dict(
+            type='buttons',
+            direction='left',
+            x=0,
+            y=0,
+            xanchor='right',
+            yanchor='top',
+            pad=dict(t=10, r=10),
+            buttons=[
+                dict(label='▶', method='animate', args=[
+                    None, dict(frame_step, frame=dict(duration=800, redraw=True), fromcurrent=True),
+                ]),
+                dict(label='⏸', method='animate', args=[
+                    [None], dict(frame_step, frame=dict(duration=0, redraw=False)),
+                ]),
+            ],
+        )],
+        margin=dict(l=0, r=0, t=0, b=80),
+        height=480,
+    )
+    return fig
+
+
+# Peta dibangun ulang hanya jika data tahun, tema warna atau DESA terpilih berubah
+if animate_years:
+    population_frames = population_by_polygon.loc[filtered_df.index]
+    fig = cached_figure(
+        'population_animation', build_animated_map, filtered_df, population_frames,
+        theme=selected_color_theme, desa=selected_DESA, zoom=MAP_ZOOM, geometry=geometry_url,
+    )
+else:
+    fig = cached_figure(
+        'population_map', build_map, filtered_df,
+        theme=selected_color_theme, desa=selected_DESA, zoom=MAP_ZOOM, geometry=geometry_url,
+    )
 
 # Fungsi heatmap dengan pemilihan tema warna
 def make_heatmap(input_df, input_y, input_x, input_color, input_color_theme):
@@ -183,19 +264,13 @@ with col[1]:
     # Display the interactive map
     st.plotly_chart(fig, use_container_width=True)
 
-    # Assuming 'geometry' column needs to be excluded
-    merged_df_no_geom = merged_df.drop(columns=['geometry'])
-
 with col[2]:
     #st.markdown('#### Top Areas')
 
     # Sort and filter data
     df_population_sorted = filtered_df.sort_values(by="population", ascending=False)
 
-    # Exclude the 'geometry' column when displaying the GeoDataFrame
-    df_population_sorted_no_geom = df_population_sorted.drop(columns=['geometry'])
-
-    st.dataframe(df_population_sorted_no_geom,
+    st.dataframe(df_population_sorted,
                  column_order=("DESA_1", "population"),
                  hide_index=True,
                  width=500,
@@ -216,7 +291,7 @@ with st.expander("HeatMap", expanded=False):
     st.markdown('#### HeatMap')
 
     # Mengasumsikan selected_color_theme adalah variabel yang menyimpan tema warna yang diinginkan
-    heatmap_chart = make_heatmap(merged_df_no_geom, 'year', 'DESA_1', 'population', selected_color_theme)
+    heatmap_chart = make_heatmap(df_csv, 'year', 'DESA_1', 'population', selected_color_theme)
 
     st.altair_chart(heatmap_chart, use_container_width=True)
 
@@ -236,3 +311,4 @@ with st.expander('Informasi', expanded=True):
 if __name__ == "__main__":
     # Call the homepage function
     data_from_homepage = homepage()
+    show_figure_cache_stats()
@@ -1,10 +1,9 @@
 import streamlit as st
-import pandas as pd
 import matplotlib.pyplot as plt
-import seaborn as sns
-from sklearn.cluster import KMeans
-from sklearn.metrics import silhouette_score
 import plotly_express as px
+from utils.clustering import load_kmeans_sweep
+from utils.data import POPULATION_WIDE_PATH, load_population_cube, load_population_distances, load_population_wide, load_year_correlation
+from utils.lazy import lazy_expander
 
 
 st.set_page_config(
@@ -54,11 +53,18 @@ with st.expander("⬇ RUMUS SSE (Sum of Squared Errors) :"):
      st.write("∣∣𝑥𝑖𝑗−𝑐𝑖∣∣2 adalah jarak kuadrat antara sampel data 𝑥𝑖𝑗 dan centroid klaster 𝑐𝑖.")
 
 
-df=pd.read_csv("AUDIT-Data_Original_Update.csv")
+# Copy of the cached data, this page adds a Cluster column
+df = load_population_wide().copy()
+
+# Shared desa x year population cube (read-only, rows aligned with df)
+population_cube = load_population_cube()
+
+# Distances between the cube rows, shared with the other pages and server processes
+population_distances = load_population_distances()
 #logo
 
 # Pilih fitur yang ingin digunakan untuk klasterisasi
-features_kmeans = df[['2011', '2012', '2013', '2014', '2015', '2016', '2017', '2018', '2019', '2020', '2021', '2022', '2023']]
+features_kmeans = population_cube['values']
 
 # Sample DataFrame
 df_sample = df.sample(n=10)  # Ambil sampel 10 desa
@@ -76,8 +82,8 @@ with st.expander("⬇ DATA UNDERSTANDING FOR KMEANS :"):
     st.write(df.describe())
 
 
-# Choose the column for the line chart
-selected_column = '2020'
+# Choose the column for the line chart: the latest year in the data
+selected_column = population_cube['years'][-1]
 
 # Calculate quartiles
 quartiles = df[selected_column].quantile([0.25, 0.5, 0.75])
@@ -86,63 +92,67 @@ quartiles = df[selected_column].quantile([0.25, 0.5, 0.75])
 c1, c2, c3 = st.columns(3)
 
 with c1:
-    with st.expander("⬇ QUARTILE TIDAK PADAT"):
-        # Display quartile values
-        st.write(f"**Quartile Information for {selected_column}:**")
-        st.write(f"- 0.25% Percentile (Q1): {quartiles[0.25]}")
-
-        # Line chart for the 25th percentile
-        fig = px.line(df, x=df.index, y=selected_column, title="Line Chart - 25th Percentile (Q1)")
-        fig.update_layout(height=300, width=400)  # Adjust the size
-        st.plotly_chart(fig)
+    with lazy_expander("⬇ QUARTILE TIDAK PADAT", key="lazy_quartile_q1") as opened:
+        if opened:
+            # Display quartile values
+            st.write(f"**Quartile Information for {selected_column}:**")
+            st.write(f"- 0.25% Percentile (Q1): {quartiles[0.25]}")
+
+            # Line chart for the 25th percentile
+            fig = px.line(df, x=df.index, y=selected_column, title="Line Chart - 25th Percentile (Q1)")
+            fig.update_layout(height=300, width=400)  # Adjust the size
+            st.plotly_chart(fig)
 
 with c2:
-    with st.expander("⬇ QUARTILE PADAT"):
-        # Display quartile values
-        st.write(f"**Quartile Information for {selected_column}:**")
-        st.write(f"- 50th Percentile (Q2): {quartiles[0.5]}")
-
-        # Line chart for the 50th percentile
-        fig = px.line(df, x=df.index, y=selected_column, title="Line Chart - 50th Percentile (Q2)")
-        fig.update_layout(height=300, width=400)  # Adjust the size
-        st.plotly_chart(fig)
+    with lazy_expander("⬇ QUARTILE PADAT", key="lazy_quartile_q2") as opened:
+        if opened:
+            # Display quartile values
+            st.write(f"**Quartile Information for {selected_column}:**")
+            st.write(f"- 50th Percentile (Q2): {quartiles[0.5]}")
+
+            # Line chart for the 50th percentile
+            fig = px.line(df, x=df.index, y=selected_column, title="Line Chart - 50th Percentile (Q2)")
+            fig.update_layout(height=300, width=400)  # Adjust the size
+            st.plotly_chart(fig)
 
 with c3:
-    with st.expander("⬇ QUARTILE SANGAT PADAT"):
-        # Display quartile values
-        st.write(f"**Quartile Information for {selected_column}:**")
-        st.write(f"- 75th Percentile (Q3): {quartiles[0.75]}")
-
-        # Line chart for the 75th percentile
-        fig = px.line(df, x=df.index, y=selected_column, title="Line Chart - 75th Percentile (Q3)")
-        fig.update_layout(height=300, width=400)  # Adjust the size
-        st.plotly_chart(fig)
+    with lazy_expander("⬇ QUARTILE SANGAT PADAT", key="lazy_quartile_q3") as opened:
+        if opened:
+            # Display quartile values
+            st.write(f"**Quartile Information for {selected_column}:**")
+            st.write(f"- 75th Percentile (Q3): {quartiles[0.75]}")
+
+            # Line chart for the 75th percentile
+            fig = px.line(df, x=df.index, y=selected_column, title="Line Chart - 75th Percentile (Q3)")
+            fig.update_layout(height=300, width=400)  # Adjust the size
+            st.plotly_chart(fig)
 
 # Membuat ekspander untuk menampilkan korelasi
-with st.expander("⬇ EKSPLORASI VARIABEL:"):
-    st.subheader("Korelasi antara Variabel")
-    st.write("Melihat matriks korelasi antara variabel dalam dataset.")
+with lazy_expander("⬇ EKSPLORASI VARIABEL:", key="lazy_correlation") as opened:
+    if opened:
+        st.subheader("Korelasi antara Variabel")
+        st.write("Melihat matriks korelasi antara variabel dalam dataset.")
     
-    # Ganti df_selection dengan dataframe yang ingin Anda gunakan
-    selected_features = ['2011', '2012', '2013', '2014', '2015', '2016', '2017', '2018', '2019', '2020', '2021', '2022', '2023']
+        # Ganti df_selection dengan dataframe yang ingin Anda gunakan
+        selected_features = population_cube['years']
     
-    # Hitung matriks korelasi
-    correlation_matrix = df[selected_features].corr()
+        # Hitung matriks korelasi
+        correlation_matrix = load_year_correlation()
 
-    # Plot heatmap using Plotly Express
-    fig = px.imshow(correlation_matrix,
-                    labels=dict(x="Features", y="Features", color="Correlation"),
-                    x=selected_features,
-                    y=selected_features,
-                    color_continuous_scale="viridis",  # Use 'viridis' instead of 'coolwarm'
-                    title="Heatmap Korelasi")
+        # Plot heatmap using Plotly Express
+        fig = px.imshow(correlation_matrix,
+                        labels=dict(x="Features", y="Features", color="Correlation"),
+                        x=selected_features,
+                        y=selected_features,
+                        color_continuous_scale="viridis",  # Use 'viridis' instead of 'coolwarm'
+                        title="Heatmap Korelasi")
 
     
-    # Show the plot
-    st.plotly_chart(fig)
+        # Show the plot
+        st.plotly_chart(fig)
     
 
-    st.write("Visualisasi ini memberikan gambaran distribusi univariat dari setiap variabel dalam dataset. Histogram menunjukkan sebaran nilai-nilai di setiap variabel, dan kernel density estimation (KDE) memberikan perkiraan kurva distribusi.")
+        st.write("Visualisasi ini memberikan gambaran distribusi univariat dari setiap variabel dalam dataset. Histogram menunjukkan sebaran nilai-nilai di setiap variabel, dan kernel density estimation (KDE) memberikan perkiraan kurva distribusi.")
 
 # checking null value
 with st.expander("⬇ NULL VALUES, TENDENCY & VARIABLE DISPERSION"):
@@ -153,54 +163,48 @@ with st.expander("⬇ NULL VALUES, TENDENCY & VARIABLE DISPERSION"):
     a2.write("Insight ke dalam kecenderungan sentral, dispersi, dan distribusi data.")
     a2.dataframe(df.describe().T, use_container_width=True)
 
-X = df[['2011', '2012', '2013', '2014', '2015', '2016', '2017', '2018', '2019', '2020', '2021', '2022', '2023']]
-kmeans = KMeans(n_clusters=3, random_state=42)
-df['Cluster'] = kmeans.fit_predict(X)
+# One KMeans fit per k (1..10) with inertia, labels and silhouette, shared with the KMeans page
+kmeans_sweep = load_kmeans_sweep(population_cube, population_distances, source=POPULATION_WIDE_PATH)
+df['Cluster'] = kmeans_sweep[3]['labels']
 
 # Metode Elbow untuk menentukan jumlah klaster optimal
-distortions = []
-for i in range(1, 11):
-    kmeans = KMeans(n_clusters=i, random_state=42)
-    kmeans.fit(features_kmeans)
-    distortions.append(kmeans.inertia_)
+distortions = [kmeans_sweep[i]['inertia'] for i in range(1, 11)]
 
 # Menghitung Silhouette Score untuk berbagai jumlah klaster
-silhouette_scores = []
-for i in range(2, 11):
-    kmeans = KMeans(n_clusters=i, random_state=42)
-    labels = kmeans.fit_predict(features_kmeans)
-    silhouette_scores.append(silhouette_score(features_kmeans, labels))
+silhouette_scores = [kmeans_sweep[i]['silhouette'] for i in range(2, 11)]
 
 c1, c2, c3 = st.columns(3)
 
 with c1:
-    with st.expander("⬇ ELBOW METHOD"):
-        st.write("Metode Elbow digunakan untuk menentukan jumlah klaster optimal dalam algoritma KMeans.")
+    with lazy_expander("⬇ ELBOW METHOD", key="lazy_elbow") as opened:
+        if opened:
+            st.write("Metode Elbow digunakan untuk menentukan jumlah klaster optimal dalam algoritma KMeans.")
         
-        # Create a figure and axis
-        fig, ax = plt.subplots(figsize=(8, 6))
-        ax.plot(range(1, 11), distortions, marker='o')
-        ax.set_title('Metode Elbow untuk Menentukan Jumlah Klaster Optimal')
-        ax.set_xlabel('Jumlah Klaster')
-        ax.set_ylabel('Distorsi')
+            # Create a figure and axis
+            fig, ax = plt.subplots(figsize=(8, 6))
+            ax.plot(range(1, 11), distortions, marker='o')
+            ax.set_title('Metode Elbow untuk Menentukan Jumlah Klaster Optimal')
+            ax.set_xlabel('Jumlah Klaster')
+            ax.set_ylabel('Distorsi')
         
-        # Pass the figure to st.pyplot
-        st.pyplot(fig)
+            # Pass the figure to st.pyplot
+            st.pyplot(fig)
 
 # Visualisasi Silhouette Score
 with c2:
-    with st.expander("⬇ SILHOUETTE SCORE"):
-        st.write("Silhouette Score digunakan untuk mengukur sejauh mana klaster terpisah dan saling berdekatan.")
-
-        # Create a figure and axis
-        fig, ax = plt.subplots(figsize=(8, 6))
-        ax.plot(range(2, 11), silhouette_scores, marker='o')
-        ax.set_title('Silhouette Score untuk Menentukan Jumlah Klaster Optimal')
-        ax.set_xlabel('Jumlah Klaster')
-        ax.set_ylabel('Silhouette Score')
+    with lazy_expander("⬇ SILHOUETTE SCORE", key="lazy_silhouette") as opened:
+        if opened:
+            st.write("Silhouette Score digunakan untuk mengukur sejauh mana klaster terpisah dan saling berdekatan.")
+
+            # Create a figure and axis
+            fig, ax = plt.subplots(figsize=(8, 6))
+            ax.plot(range(2, 11), silhouette_scores, marker='o')
+            ax.set_title('Silhouette Score untuk Menentukan Jumlah Klaster Optimal')
+            ax.set_xlabel('Jumlah Klaster')
+            ax.set_ylabel('Silhouette Score')
         
-        # Pass the figure to st.pyplot
-        st.pyplot(fig)
+            # Pass the figure to st.pyplot
+            st.pyplot(fig)
 
 # Kesimpulan
 with c3:
@@ -217,13 +221,16 @@ with c3:
 
 
 # Display the scatter plot using Plotly Express for 2 clusters
-with st.expander("⬇ CLUSTER VISUALIZATION"):
+with lazy_expander("⬇ CLUSTER VISUALIZATION", key="lazy_cluster_visualization") as opened:
+    if opened:
     
-    fig = px.scatter(df, x='2022', y='2023', color='Cluster',
-                     title="Clusters of Customers (2 Clusters)", labels={'2022': '2022', '2023': '2023'},
-                     color_continuous_scale='viridis', size_max=10, range_color=[0, 1])
-    fig.update_traces(marker=dict(size=12, opacity=0.8),
-                      selector=dict(mode='markers'))
-    fig.update_layout(showlegend=True)
-    st.plotly_chart(fig)
+        # The two latest years in the data
+        previous_year, latest_year = population_cube['years'][-2:]
+        fig = px.scatter(df, x=previous_year, y=latest_year, color='Cluster',
+                         title="Clusters of Customers (2 Clusters)", labels={previous_year: previous_year, latest_year: latest_year},
+                         color_continuous_scale='viridis', size_max=10, range_color=[0, 1])
+        fig.update_traces(marker=dict(size=12, opacity=0.8),
+                          selector=dict(mode='markers'))
+        fig.update_layout(showlegend=True)
+        st.plotly_chart(fig)
 
@@ -1,10 +1,20 @@
 import streamlit as st
 import pandas as pd
-from sklearn.cluster import KMeans
-import geopandas as gpd
 import plotly.express as px
 import plotly.graph_objects as go
-from sklearn.metrics import silhouette_score
+from utils.clustering import (
+    CLUSTER_FEATURES, KMEANS_BACKENDS, KMEANS_K_RANGE, density_categories, load_kmeans_sweep, load_trajectory_kmeans_sweep,
+    resolve_kmeans_backend,
+)
+from utils.data import (
+    POPULATION_WIDE_PATH, geometry_asset_url, load_desa_index, load_geometry_tier, load_population_cube,
+    load_population_distances, load_population_wide,
+)
+from utils.figures import cached_figure, show_figure_cache_stats
+from utils.lazy import lazy_expander, lazy_tabs
+from utils.population import DESA_KEY
+from utils.progress import stage_progress
+from utils.stability import STABILITY_RESAMPLES, kmeans_references, load_stability
 import time
 
 
@@ -16,29 +26,24 @@ st.set_page_config(
 ) 
 
 
-def kmeans_clustering(data, num_clusters, selected_year):
-    # Select columns for clustering
-    features = data[['2011', '2012', '2013', '2014', '2015', '2016', '2017', '2018', '2019', '2020', '2021', '2022', '2023']]
-    
-    # Perform KMeans clustering
-    kmeans = KMeans(n_clusters=num_clusters, random_state=42)
-    data['cluster'] = kmeans.fit_predict(features)
-    
-    # Calculate centroid for each cluster
-    centroids = data.groupby('cluster')[['2011', '2012', '2013', '2014', '2015', '2016', '2017', '2018', '2019', '2020', '2021', '2022', '2023']].mean()
+def kmeans_clustering(data, cube, sweep, num_clusters, selected_year):
+    # Clustering features: the shared desa x year population cube, rows aligned with data
+    features = cube['values']
 
-    # Define threshold values for density categories (adjust these based on your analysis)
-    threshold_low = 3131.750000  # Example threshold for "not dense"
-    threshold_high = 5679.750000  # Example threshold for "dense"
+    # Work on a copy, the loaded data is shared between sessions
+    data = data.copy()
 
-    # Add Density Category column based on centroid values
-    data['Density Category'] = data['cluster'].map(lambda cluster: 'Tidak Padat' if centroids.loc[cluster].mean() < threshold_low else ('Padat' if centroids.loc[cluster].mean() < threshold_high else 'Sangat Padat'))
+    # KMeans labels for num_clusters, taken from the k-sweep (every k is fitted once per dataset)
+    data['cluster'] = sweep[num_clusters]['labels']
+
+    # Add Density Category column based on the mean population of each cluster centroid
+    data['Density Category'] = density_categories(features, data['cluster'])
     
     # Elbow Method data
-    elbow_data = pd.DataFrame({'num_clusters': range(1, 11),
-                               'inertia': [KMeans(n_clusters=i, random_state=42).fit(features).inertia_ for i in range(1, 11)]})
-    # Calculate Silhouette Score
-    silhouette_avg = silhouette_score(features, data['cluster'])
+    elbow_data = pd.DataFrame({'num_clusters': KMEANS_K_RANGE,
+                               'inertia': [sweep[i]['inertia'] for i in KMEANS_K_RANGE]})
+    # Silhouette Score of the selected clustering
+    silhouette_avg = sweep[num_clusters]['silhouette']
 
     return data, silhouette_avg, elbow_data
 
@@ -50,64 +55,94 @@ def SilhouetteProgressBar(silhouette_avg, target):
 
     current = silhouette_avg
     percent = round((current / target * 100))
-    mybar = st.progress(0)
+
+    # The score is already computed, draw it at once (a negative silhouette shows as an empty bar)
+    st.progress(min(max(percent, 0), 100), text="Silhouette Score Percentage")
 
     if percent >= 100:
         st.subheader("Target silhouette score achieved!")
     else:
         st.write("Skor yang dicapai {:.2f}% dari skor target".format(percent))
 
-        for percent_complete in range(percent):
-            time.sleep(0.1)
-            mybar.progress(percent_complete + 1, text="Silhouette Score Percentage")
+
+# Bootstrap stability of the selected clustering: mean ARI of the resample refits for every k, and how
+# often each desa stayed in its cluster
+def show_stability(stability, n_clusters, data):
+    st.write("Rata-rata ARI {} resample bootstrap untuk {} klaster: {:.3f}".format(
+        STABILITY_RESAMPLES, n_clusters, stability['ari'][n_clusters]))
+    ari = pd.DataFrame({'num_clusters': list(stability['ari']), 'ari': list(stability['ari'].values())})
+    fig_ari = px.line(ari, x='num_clusters', y='ari', markers=True, title='Stabilitas per Jumlah Klaster',
+                      labels={'num_clusters': 'Number of Clusters', 'ari': 'Mean ARI'})
+    st.plotly_chart(fig_ari, use_container_width=True)
+    confidence = data[['DESA_1', 'cluster']].assign(confidence=stability['confidence'][n_clusters])
+    st.dataframe(confidence.sort_values('confidence'),
+                 hide_index=True,
+                 use_container_width=True,
+                 column_config={
+                     "DESA_1": st.column_config.TextColumn("Area"),
+                     "confidence": st.column_config.ProgressColumn(
+                         "Keyakinan", format="%.2f", min_value=0, max_value=1,
+                     )}
+                 )
     
+# Zoom level of the cluster map, also selects the simplified geometry tier
+MAP_ZOOM = 9.5
+
+
 # Function to create GeoMap with Plotly Express
 def create_geomap(data, geojson_data, selected_color_theme):
-    # Merge GeoJSON data with clustered data based on 'DESA_1'
-    merged_data = geojson_data.merge(data, left_on='DESA_1', right_on='DESA_1')
+    # Merge GeoJSON data with clustered data on (DESA_1, KECAMATAN), keeping each row's polygon position
+    merged_data = geojson_data[DESA_KEY].assign(feature=range(len(geojson_data))).merge(data, on=DESA_KEY)
+
+    # Polygons served once as a static file when the server allows it, embedded in the figure otherwise
+    geometry_url = geometry_asset_url(MAP_ZOOM)
 
     # Sidebar to select 'DESA_1'
     selected_DESA = st.sidebar.selectbox("Pilih Desa pada map ", merged_data['DESA_1'].unique())
 
-    # Filter data for selected 'DESA_1'
-    filtered_df_DESA = merged_data[merged_data['DESA_1'] == selected_DESA]
-
-    # Get coordinates for the selected 'DESA_1'
-    selected_lon = filtered_df_DESA.geometry.centroid.x.values[0]
-    selected_lat = filtered_df_DESA.geometry.centroid.y.values[0]
-
-    # Plot GeoMap with Plotly Express
-    fig = px.choropleth_mapbox(
-        merged_data,
-        geojson=merged_data.geometry,
-        locations=merged_data.index,
-        hover_name='DESA_1',
-        color='cluster',
-        color_continuous_scale=selected_color_theme,
-        mapbox_style="carto-darkmatter",
-        zoom=9.5,
-        center={"lat": merged_data.geometry.centroid.y.mean(), "lon": merged_data.geometry.centroid.x.mean()},
-        labels={'cluster': 'Cluster'}
+    def build():
+        # Get coordinates for the selected 'DESA_1' from the precomputed centroid index
+        desa_index = load_desa_index()
+        selected_lon = desa_index['desa'][selected_DESA]['lon']
+        selected_lat = desa_index['desa'][selected_DESA]['lat']
+
+        # Plot GeoMap with Plotly Express
+        fig = px.choropleth_mapbox(
+            merged_data,
+            geojson=geometry_url or geojson_data.geometry,
+            locations='feature',
+            hover_name='DESA_1',
+            color='cluster',
+            color_continuous_scale=selected_color_theme,
+            mapbox_style="carto-darkmatter",
+            zoom=MAP_ZOOM,
+            center=desa_index['center'],
+            labels={'cluster': 'Cluster'}
+        )
+
+        # Add marker for the selected 'DESA_1'
+        fig.add_trace(go.Scattermapbox(
+            mode="markers+text",
+            lon=[selected_lon],
+            lat=[selected_lat],
+            marker=dict(size=14, color="red"),
+            text=[selected_DESA],
+            hoverinfo='text',
+            showlegend=False
+        ))
+
+        # Set the map layout
+        fig.update_layout(
+            autosize=True,
+            margin=dict(l=0, r=0, t=0, b=0),
+        )
+        return fig
+
+    # Show the GeoMap, rebuilt only when the clusters, theme or selected desa change
+    fig = cached_figure(
+        'cluster_map', build, data[DESA_KEY + ['cluster']],
+        theme=selected_color_theme, desa=selected_DESA, zoom=MAP_ZOOM, geometry=geometry_url,
     )
-
-    # Add marker for the selected 'DESA_1'
-    fig.add_trace(go.Scattermapbox(
-        mode="markers+text",
-        lon=[selected_lon],
-        lat=[selected_lat],
-        marker=dict(size=14, color="red"),
-        text=[selected_DESA],
-        hoverinfo='text',
-        showlegend=False
-    ))
-
-    # Set the map layout
-    fig.update_layout(
-        autosize=True,
-        margin=dict(l=0, r=0, t=0, b=0),
-    )
-
-    # Show the GeoMap
     st.plotly_chart(fig, use_container_width=True)
 
 def kmeans_page():
@@ -117,25 +152,79 @@ def kmeans_page():
     # Sidebar: Choose the number of clusters
     num_clusters = st.sidebar.slider("Number Clusters", min_value=2, max_value=10, value=3)
 
-    # Select Year in the Sidebar
-    selected_year = st.sidebar.selectbox('Pilih Tahun', ['2011', '2012', '2013', '2014', '2015', '2016', '2017', '2018', '2019', '2020', '2021', '2022', '2023'])
+    # Sidebar: KMeans backend, 'auto' switches to MiniBatch KMeans on province/national sized data
+    kmeans_backend = st.sidebar.selectbox("KMeans Backend", KMEANS_BACKENDS, key="kmeans_backend_selector")
+
+    # Sidebar: cluster on population size per year, or on the shape of each desa's growth curve (DTW)
+    cluster_features = st.sidebar.selectbox("Fitur Klaster", CLUSTER_FEATURES, key="cluster_features_selector")
+
+    # Loading stages behind one progress bar, each advances it when done (instant when cached)
+    advance = stage_progress(["Memuat data populasi", "Fitting KMeans untuk setiap jumlah klaster"])
 
     # Load data from the home page
-    data_from_homepage = pd.read_csv('AUDIT-Data_Original_Update.csv')  # Replace with your actual data
+    data_from_homepage = load_population_wide()
+    population_cube = load_population_cube()
+    population_distances = load_population_distances()
+    advance()
+
+    # Inertia, labels and silhouette for every k, fitted once per dataset and backend and shared between
+    # sessions; each fit starts from the artifact centroids when they are fresh, from k-means++ otherwise
+    lookup_start = time.perf_counter()
+    if cluster_features == 'trajectory':
+        kmeans_sweep = load_trajectory_kmeans_sweep(population_cube)
+        st.sidebar.caption("Backend: DTW medoid")
+    else:
+        kmeans_sweep = load_kmeans_sweep(population_cube, population_distances, source=POPULATION_WIDE_PATH, backend=kmeans_backend)
+        st.sidebar.caption(f"Backend: {resolve_kmeans_backend(kmeans_backend, len(data_from_homepage))}")
+
+    # Select Year in the Sidebar
+    selected_year = st.sidebar.selectbox('Pilih Tahun', population_cube['years'])
 
     # Perform KMeans clustering
-    df_clustered, silhouette_avg, elbow_data = kmeans_clustering(data_from_homepage, num_clusters, selected_year)
+    df_clustered, silhouette_avg, elbow_data = kmeans_clustering(data_from_homepage, population_cube, kmeans_sweep, num_clusters, selected_year)
+    lookup_ms = (time.perf_counter() - lookup_start) * 1000
+    advance()
 
     # Save the clustered data and elbow data in session_state
     st.session_state.df_clustered = df_clustered
     st.session_state.elbow_data = elbow_data
 
-    tab1, tab2 = st.tabs(["DATASET", "VISUALISASI MAP"])
+    # Theme color selection for GeoMap (outside the map section, so the choice survives switching sections)
+    color_theme_list = ['Blues', 'cividis', 'Greens', 'inferno', 'magma', 'plasma', 'reds', 'rainbow', 'turbo', 'viridis']
+    selected_color_theme = st.sidebar.selectbox('Pilih tema warna pada map', color_theme_list, key="geo_map_color_theme_selector")
+
+    # Only the selected section runs
+    tab = lazy_tabs(["DATASET", "VISUALISASI MAP"], key="kmeans_page_tab")
 
-    with tab1:
+    if tab == "DATASET":
         # Progress bar for Silhouette Score
         SilhouetteProgressBar(silhouette_avg, target=1.0)
 
+        # On large datasets the silhouette is estimated from a sample of desa, show how precise it is
+        silhouette_interval = kmeans_sweep[num_clusters]['silhouette_interval']
+        if silhouette_interval is not None:
+            st.caption("Silhouette score diestimasi dari sampel desa, interval kepercayaan 95%: {:.3f} - {:.3f}".format(*silhouette_interval))
+
+        # How reproducible the clusters are under resampling
+        # (resampled only once the section is opened, then shared between sessions)
+        if cluster_features == 'population':
+            with lazy_expander("⬇ STABILITAS KLASTER (BOOTSTRAP)", key="lazy_stability") as opened:
+                if opened:
+                    stability = load_stability(population_cube, kmeans_references(kmeans_sweep), population_distances)
+                    show_stability(stability['kmeans'], num_clusters, df_clustered)
+
+        # How each k was started and fitted, and the latency saved by serving changes from the sweep
+        with st.expander("⬇ STATISTIK FITTING KMEANS"):
+            fit_stats = pd.DataFrame({
+                'k': list(kmeans_sweep),
+                'start': [result['start'] for result in kmeans_sweep.values()],
+                'iterations': [result['n_iter'] for result in kmeans_sweep.values()],
+                'fit (ms)': [result['seconds'] * 1000 for result in kmeans_sweep.values()],
+            })
+            st.dataframe(fit_stats, hide_index=True, use_container_width=True)
+            st.write(f"Perubahan jumlah klaster atau tahun dilayani dari hasil sweep dalam {lookup_ms:.1f} ms, "
+                     f"tanpa fitting ulang (satu kali sweep: {fit_stats['fit (ms)'].sum():.0f} ms).")
+
 
         # Display metrics for each cluster
         for cluster_num in range(num_clusters):
@@ -165,15 +254,10 @@ def kmeans_page():
                                 )}
                             )
 
-    with tab2:
-        # Load GeoJSON file
-        geojson_path = 'andy.geojson'
-        geojson_data = gpd.read_file(geojson_path)
+    if tab == "VISUALISASI MAP":
+        # Load GeoJSON file (cached once per server process, simplified for MAP_ZOOM)
+        geojson_data = load_geometry_tier(MAP_ZOOM)
 
-        # Theme color selection for GeoMap
-        color_theme_list = ['Blues', 'cividis', 'Greens', 'inferno', 'magma', 'plasma', 'reds', 'rainbow', 'turbo', 'viridis']
-        selected_color_theme = st.sidebar.selectbox('Pilih tema warna pada map', color_theme_list, key="geo_map_color_theme_selector")
-        
         with st.container(border=True):
             create_geomap(df_clustered, geojson_data, selected_color_theme)
 
@@ -190,61 +274,73 @@ def kmeans_page():
         with col1:
             with st.container(border=True):
                 # Simple line chart showing the count of data points in each cluster
-                cluster_counts = df_clustered['cluster'].value_counts().sort_index()
-                fig_cluster_counts = px.line(
-                    x=cluster_counts.index,
-                    y=cluster_counts.values,
-                    labels={'x': 'Cluster', 'y': 'Data Point Count'},
-                    title='<b>Data Point Count by Cluster</b>',
-                    line_shape="linear",
-                    render_mode="svg",
-                    markers=True
-                )
-                fig_cluster_counts.update_layout(
-                    plot_bgcolor='rgba(0, 0, 0, 0)',  # Set plot background color to transparent
-                    paper_bgcolor='rgba(0, 0, 0, 0)',  # Set paper background color to transparent
-                    xaxis=dict(showgrid=True, gridcolor='#cecdcd'),  # Show x-axis grid and set its color
-                    yaxis=dict(showgrid=True, gridcolor='#cecdcd'),  # Show y-axis grid and set its color
-                    font=dict(color='#cecdcd'),  # Set text color to black
-                )
+                def build():
+                    cluster_counts = df_clustered['cluster'].value_counts().sort_index()
+                    fig_cluster_counts = px.line(
+                        x=cluster_counts.index,
+                        y=cluster_counts.values,
+                        labels={'x': 'Cluster', 'y': 'Data Point Count'},
+                        title='<b>Data Point Count by Cluster</b>',
+                        line_shape="linear",
+                        render_mode="svg",
+                        markers=True
+                    )
+                    fig_cluster_counts.update_layout(
+                        plot_bgcolor='rgba(0, 0, 0, 0)',  # Set plot background color to transparent
+                        paper_bgcolor='rgba(0, 0, 0, 0)',  # Set paper background color to transparent
+                        xaxis=dict(showgrid=True, gridcolor='#cecdcd'),  # Show x-axis grid and set its color
+                        yaxis=dict(showgrid=True, gridcolor='#cecdcd'),  # Show y-axis grid and set its color
+                        font=dict(color='#cecdcd'),  # Set text color to black
+                    )
+                    return fig_cluster_counts
+                fig_cluster_counts = cached_figure('cluster_counts', build, df_clustered['cluster'])
                 st.plotly_chart(fig_cluster_counts, use_container_width=True)
 
         with col2:
             
             with st.container(border=True):
                 # Create a donut chart
-                fig = px.pie(df_clustered, names='cluster', title='Cluster Distribution')
-                fig.update_traces(hole=0.4)  # Set the size of the hole in the middle for a donut chart
-                fig.update_layout(width=800)
+                def build():
+                    fig = px.pie(df_clustered, names='cluster', title='Cluster Distribution')
+                    fig.update_traces(hole=0.4)  # Set the size of the hole in the middle for a donut chart
+                    fig.update_layout(width=800)
+                    return fig
+                fig = cached_figure('cluster_donut', build, df_clustered['cluster'])
                 st.plotly_chart(fig, use_container_width=True)
 
         with col3:
             with st.container(border=True):
-                fig2 = go.Figure(
-                    data=[go.Bar(x=df_clustered['cluster'], y=df_clustered[selected_year])],
-                    layout=go.Layout(
-                        title=go.layout.Title(text=f"Population Distribution by Cluster for {selected_year}"),
-                        plot_bgcolor='rgba(0, 0, 0, 0)',  # Set plot background color to transparent
-                        paper_bgcolor='rgba(0, 0, 0, 0)',  # Set paper background color to transparent
-                        xaxis=dict(showgrid=True, gridcolor='#cecdcd'),  # Show x-axis grid and set its color
-                        yaxis=dict(showgrid=True, gridcolor='#cecdcd'),  # Show y-axis grid and set its color
-                        font=dict(color='#cecdcd'),  # Set text color to black
+                def build():
+                    fig2 = go.Figure(
+                        data=[go.Bar(x=df_clustered['cluster'], y=df_clustered[selected_year])],
+                        layout=go.Layout(
+                            title=go.layout.Title(text=f"Population Distribution by Cluster for {selected_year}"),
+                            plot_bgcolor='rgba(0, 0, 0, 0)',  # Set plot background color to transparent
+                            paper_bgcolor='rgba(0, 0, 0, 0)',  # Set paper background color to transparent
+                            xaxis=dict(showgrid=True, gridcolor='#cecdcd'),  # Show x-axis grid and set its color
+                            yaxis=dict(showgrid=True, gridcolor='#cecdcd'),  # Show y-axis grid and set its color
+                            font=dict(color='#cecdcd'),  # Set text color to black
+                        )
                     )
-                )
+                    return fig2
+                fig2 = cached_figure('cluster_population', build, df_clustered[['cluster', selected_year]], year=selected_year)
                 st.plotly_chart(fig2, use_container_width=True)
 
         with col4:
             with st.container(border=True):
                     # Elbow Method Line Chart
-                    fig_elbow = px.line(elbow_data, x='num_clusters', y='inertia', markers=True, title='Elbow Method',
-                                        labels={'num_clusters': 'Number of Clusters', 'inertia': 'Inertia'})
-                    fig_elbow.update_layout(
-                        plot_bgcolor='rgba(0, 0, 0, 0)',
-                        paper_bgcolor='rgba(0, 0, 0, 0)',
-                        xaxis=dict(showgrid=True, gridcolor='#cecdcd'),
-                        yaxis=dict(showgrid=True, gridcolor='#cecdcd'),
-                        font=dict(color='#cecdcd'),
-                    )
+                    def build():
+                        fig_elbow = px.line(elbow_data, x='num_clusters', y='inertia', markers=True, title='Elbow Method',
+                                            labels={'num_clusters': 'Number of Clusters', 'inertia': 'Inertia'})
+                        fig_elbow.update_layout(
+                            plot_bgcolor='rgba(0, 0, 0, 0)',
+                            paper_bgcolor='rgba(0, 0, 0, 0)',
+                            xaxis=dict(showgrid=True, gridcolor='#cecdcd'),
+                            yaxis=dict(showgrid=True, gridcolor='#cecdcd'),
+                            font=dict(color='#cecdcd'),
+                        )
+                        return fig_elbow
+                    fig_elbow = cached_figure('elbow', build, elbow_data)
                     st.plotly_chart(fig_elbow, use_container_width=True)
 
         with st.expander('kesimpulan', expanded=True):
@@ -284,3 +380,4 @@ def kmeans_page():
 if __name__ == "__main__":
     # Call the kmeans_page function
     kmeans_page()
+    show_figure_cache_stats()
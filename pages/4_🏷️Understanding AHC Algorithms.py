@@ -1,14 +1,14 @@
 import streamlit as st
 import pandas as pd
-import matplotlib.pyplot as plt
-from sklearn.cluster import KMeans
-from sklearn.cluster import AgglomerativeClustering
-from scipy.cluster.hierarchy import dendrogram, linkage
-from sklearn.metrics import silhouette_score
+from scipy.cluster.hierarchy import dendrogram
 import plotly_express as px
-from scipy.cluster.hierarchy import cophenet, dendrogram, linkage
-from scipy.spatial.distance import pdist
+from utils.clustering import load_ahc_sweep
+from utils.data import load_population_cube, load_population_distances, load_population_wide, load_year_correlation
+from utils.distances import dataset_fingerprint
+from utils.lazy import lazy_expander
 from scipy.cluster.hierarchy import fcluster
+from matplotlib.figure import Figure
+import io
 
 
 st.set_page_config(
@@ -18,6 +18,22 @@ st.set_page_config(
     initial_sidebar_state="collapsed",  # Collapse the sidebar by default
 ) 
 
+
+# Dendrogram of a linkage tree as a PNG, drawn once per tree and shared by every rerun and session
+@st.cache_resource(show_spinner=False, max_entries=6)
+def dendrogram_png(fingerprint, title, _tree):
+    # A bare Figure rather than pyplot, whose global state is not safe across session threads
+    fig = Figure(figsize=(8, 6))
+    ax = fig.subplots()
+    dendrogram(_tree, ax=ax)
+    ax.set_title(title)
+    ax.set_xlabel('Indeks Data')
+    ax.set_ylabel('Distance')
+    buffer = io.BytesIO()
+    fig.savefig(buffer, format='png', dpi=200, bbox_inches='tight')
+    return buffer.getvalue()
+
+
 with open('style.css') as f:
     st.markdown(f"<style>{f.read()}</style>", unsafe_allow_html=True)
 
@@ -56,14 +72,11 @@ with st.expander("⬇ Berikut Rumus Perhitungan Jarak Euclidean :"):
      st.write("x1,x2,…,x n adalah koordinat titik 𝑥 dalam dimensi ke-𝑛.")
      st.write("y1,y2,…,y n adalah koordinat titik 𝑦 dalam dimensi ke-𝑛.")
 
-# Read data
-df = pd.read_csv("AUDIT-Data_Original_Update.csv")
+# Read data (shared between sessions, read-only)
+df = load_population_wide()
 
-# Select features for clustering
-features_ahc = df[['2011', '2012', '2013', '2014', '2015', '2016', '2017', '2018', '2019', '2020', '2021', '2022', '2023', 'Latitude', 'Longitude']]
-
-# Agglomerative Hierarchical Clustering method
-linkage_matrix = linkage(features_ahc, method='ward')
+# Shared desa x year population cube (read-only, rows aligned with df)
+population_cube = load_population_cube()
 
 # Ekspander untuk menampilkan data
 with st.expander("⬇ DATA UNDERSTANDING FOR AGGLOMERATIVE HIERARCHICAL CLUSTERING :"):
@@ -79,8 +92,8 @@ with st.expander("⬇ DATA UNDERSTANDING FOR AGGLOMERATIVE HIERARCHICAL CLUSTERI
    
 
 
-# Choose the column for the line chart
-selected_column = '2023'
+# Choose the column for the line chart: the latest year in the data
+selected_column = population_cube['years'][-1]
 
 # Calculate quartiles
 quartiles = df[selected_column].quantile([0.25, 0.5, 0.75])
@@ -89,59 +102,63 @@ quartiles = df[selected_column].quantile([0.25, 0.5, 0.75])
 c1, c2, c3 = st.columns(3)
 
 with c1:
-    with st.expander("⬇ QUARTILE TIDAK PADAT"):
-        # Display quartile values
-        st.write(f"**Quartile Information for {selected_column}:**")
-        st.write(f"- 0.25% Percentile (Q1): {quartiles[0.25]}")
-
-        # Line chart for the 25th percentile
-        fig = px.line(df, x=df.index, y=selected_column, title="Line Chart - 25th Percentile (Q1)")
-        fig.update_layout(height=300, width=400)  # Adjust the size
-        st.plotly_chart(fig)
+    with lazy_expander("⬇ QUARTILE TIDAK PADAT", key="lazy_quartile_q1") as opened:
+        if opened:
+            # Display quartile values
+            st.write(f"**Quartile Information for {selected_column}:**")
+            st.write(f"- 0.25% Percentile (Q1): {quartiles[0.25]}")
+
+            # Line chart for the 25th percentile
+            fig = px.line(df, x=df.index, y=selected_column, title="Line Chart - 25th Percentile (Q1)")
+            fig.update_layout(height=300, width=400)  # Adjust the size
+            st.plotly_chart(fig)
 
 with c2:
-    with st.expander("⬇ QUARTILE PADAT"):
-        # Display quartile values
-        st.write(f"**Quartile Information for {selected_column}:**")
-        st.write(f"- 50th Percentile (Q2): {quartiles[0.5]}")
-
-        # Line chart for the 50th percentile
-        fig = px.line(df, x=df.index, y=selected_column, title="Line Chart - 50th Percentile (Q2)")
-        fig.update_layout(height=300, width=400)  # Adjust the size
-        st.plotly_chart(fig)
+    with lazy_expander("⬇ QUARTILE PADAT", key="lazy_quartile_q2") as opened:
+        if opened:
+            # Display quartile values
+            st.write(f"**Quartile Information for {selected_column}:**")
+            st.write(f"- 50th Percentile (Q2): {quartiles[0.5]}")
+
+            # Line chart for the 50th percentile
+            fig = px.line(df, x=df.index, y=selected_column, title="Line Chart - 50th Percentile (Q2)")
+            fig.update_layout(height=300, width=400)  # Adjust the size
+            st.plotly_chart(fig)
 
 with c3:
-    with st.expander("⬇ QUARTILE SANGAT PADAT"):
-        # Display quartile values
-        st.write(f"**Quartile Information for {selected_column}:**")
-        st.write(f"- 75th Percentile (Q3): {quartiles[0.75]}")
-
-        # Line chart for the 75th percentile
-        fig = px.line(df, x=df.index, y=selected_column, title="Line Chart - 75th Percentile (Q3)")
-        fig.update_layout(height=300, width=400)  # Adjust the size
-        st.plotly_chart(fig)
+    with lazy_expander("⬇ QUARTILE SANGAT PADAT", key="lazy_quartile_q3") as opened:
+        if opened:
+            # Display quartile values
+            st.write(f"**Quartile Information for {selected_column}:**")
+            st.write(f"- 75th Percentile (Q3): {quartiles[0.75]}")
+
+            # Line chart for the 75th percentile
+            fig = px.line(df, x=df.index, y=selected_column, title="Line Chart - 75th Percentile (Q3)")
+            fig.update_layout(height=300, width=400)  # Adjust the size
+            st.plotly_chart(fig)
 
 # Exploring variables
-with st.expander("⬇ EKSPLORASI VARIABEL:"):
-    st.subheader("Korelasi antara Variabel")
-    st.write("Melihat matriks korelasi antara variabel dalam dataset.")
+with lazy_expander("⬇ EKSPLORASI VARIABEL:", key="lazy_correlation") as opened:
+    if opened:
+        st.subheader("Korelasi antara Variabel")
+        st.write("Melihat matriks korelasi antara variabel dalam dataset.")
     
-    selected_features = ['2011', '2012', '2013', '2014', '2015', '2016', '2017', '2018', '2019', '2020', '2021', '2022', '2023']
+        selected_features = population_cube['years']
     
-    # Calculate correlation matrix
-    correlation_matrix = df[selected_features].corr()
-
-    # Plot heatmap using Plotly Express
-    fig = px.imshow(correlation_matrix,
-                    labels=dict(x="Features", y="Features", color="Correlation"),
-                    x=selected_features,
-                    y=selected_features,
-                    color_continuous_scale="viridis",  
-                    title="Heatmap Korelasi")
+        # Calculate correlation matrix
+        correlation_matrix = load_year_correlation()
+
+        # Plot heatmap using Plotly Express
+        fig = px.imshow(correlation_matrix,
+                        labels=dict(x="Features", y="Features", color="Correlation"),
+                        x=selected_features,
+                        y=selected_features,
+                        color_continuous_scale="viridis",  
+                        title="Heatmap Korelasi")
     
-    st.plotly_chart(fig)
+        st.plotly_chart(fig)
     
-    st.write("Visualisasi ini memberikan gambaran distribusi univariat dari setiap variabel dalam dataset. Histogram menunjukkan sebaran nilai-nilai di setiap variabel, dan kernel density estimation (KDE) memberikan perkiraan kurva distribusi.")
+        st.write("Visualisasi ini memberikan gambaran distribusi univariat dari setiap variabel dalam dataset. Histogram menunjukkan sebaran nilai-nilai di setiap variabel, dan kernel density estimation (KDE) memberikan perkiraan kurva distribusi.")
 
 # checking null value
 with st.expander("⬇ NULL VALUES, TENDENCY & VARIABLE DISPERSION"):
@@ -152,25 +169,24 @@ with st.expander("⬇ NULL VALUES, TENDENCY & VARIABLE DISPERSION"):
     a2.write("Insight ke dalam kecenderungan sentral, dispersi, dan distribusi data.")
     a2.dataframe(df.describe().T, use_container_width=True)
 
-# Apply Agglomerative Hierarchical Clustering (AHC)
-X_ahc = df[['2011', '2012', '2013', '2014', '2015', '2016', '2017', '2018', '2019', '2020', '2021', '2022', '2023']]
-ahc = AgglomerativeClustering(n_clusters=None, distance_threshold=0)
-df['Cluster_AHC'] = ahc.fit_predict(X_ahc)
+# Clustering features: the shared desa x year population cube
+X_ahc = population_cube['values']
+
+# Trees, CCC and silhouette per k for every linkage method, built once from the shared condensed
+# distances of the cube (the AHC page uses the same sweep)
+ahc_sweep = load_ahc_sweep(X_ahc, load_population_distances())
 
-# Calculate CCC for Ward linkage
-linkage_matrix_single = linkage(X_ahc, method='single')
-cophenet_matrix_single, _ = cophenet(linkage_matrix_single, pdist(X_ahc))
-ccc_single = cophenet_matrix_single.mean()
+# CCC for Single linkage
+linkage_matrix_single = ahc_sweep['single']['tree']
+ccc_single = ahc_sweep['single']['ccc']
 
-# Calculate CCC for Average linkage
-linkage_matrix_average = linkage(X_ahc, method='average')
-cophenet_matrix_average, _ = cophenet(linkage_matrix_average, pdist(X_ahc))
-ccc_average = cophenet_matrix_average.mean()
+# CCC for Average linkage
+linkage_matrix_average = ahc_sweep['average']['tree']
+ccc_average = ahc_sweep['average']['ccc']
 
-# Calculate CCC for Complete linkage
-linkage_matrix_complete = linkage(X_ahc, method='complete')
-cophenet_matrix_complete, _ = cophenet(linkage_matrix_complete, pdist(X_ahc))
-ccc_complete = cophenet_matrix_complete.mean()
+# CCC for Complete linkage
+linkage_matrix_complete = ahc_sweep['complete']['tree']
+ccc_complete = ahc_sweep['complete']['ccc']
 
 
 # Definisikan tinggi pemotongan untuk setiap metode linkage
@@ -189,40 +205,31 @@ labels_complete = fcluster(linkage_matrix_complete, t=cut_height_complete, crite
 c1, c2, c3 = st.columns(3)
 
 with c1:
-    with st.expander("⬇ DENDROGRAM SINGLE"):
-        # Visualisasi Dendrogram untuk Single
-        fig_single, ax_single = plt.subplots(figsize=(8, 6))
-        dendrogram(linkage_matrix_single, ax=ax_single)
-        ax_single.set_title('Dendrogram AHC (Single)')
-        ax_single.set_xlabel('Indeks Data')
-        ax_single.set_ylabel('Distance')
-        st.pyplot(fig_single)
+    with lazy_expander("⬇ DENDROGRAM SINGLE", key="lazy_dendrogram_single") as opened:
+        if opened:
+            # Visualisasi Dendrogram untuk Single
+            st.image(dendrogram_png(dataset_fingerprint(linkage_matrix_single), 'Dendrogram AHC (Single)', linkage_matrix_single),
+                     use_column_width=True)
 
-        st.write(f"Cophenetic Correlation Coefficient (CCC) untuk Dendrogram AHC (Single): {ccc_single:.4f}")
+            st.write(f"Cophenetic Correlation Coefficient (CCC) untuk Dendrogram AHC (Single): {ccc_single:.4f}")
 
 with c2:
-    with st.expander("⬇ DENDROGRAM AVERAGE"):
-        # Visualisasi Dendrogram untuk Average
-        fig_average, ax_average = plt.subplots(figsize=(8, 6))
-        dendrogram(linkage_matrix_average, ax=ax_average)
-        ax_average.set_title('Dendrogram AHC (Average)')
-        ax_average.set_xlabel('Indeks Data')
-        ax_average.set_ylabel('Distance')
-        st.pyplot(fig_average)
+    with lazy_expander("⬇ DENDROGRAM AVERAGE", key="lazy_dendrogram_average") as opened:
+        if opened:
+            # Visualisasi Dendrogram untuk Average
+            st.image(dendrogram_png(dataset_fingerprint(linkage_matrix_average), 'Dendrogram AHC (Average)', linkage_matrix_average),
+                     use_column_width=True)
 
-        st.write(f"Cophenetic Correlation Coefficient (CCC) untuk Dendrogram AHC (Average): {ccc_average:.4f}")
+            st.write(f"Cophenetic Correlation Coefficient (CCC) untuk Dendrogram AHC (Average): {ccc_average:.4f}")
 
 with c3:
-    with st.expander("⬇ DENDROGRAM COMPLETE"):
-        # Visualisasi Dendrogram untuk Complete
-        fig_complete, ax_complete = plt.subplots(figsize=(8, 6))
-        dendrogram(linkage_matrix_complete, ax=ax_complete)
-        ax_complete.set_title('Dendrogram AHC (Complete)')
-        ax_complete.set_xlabel('Indeks Data')
-        ax_complete.set_ylabel('Distance')
-        st.pyplot(fig_complete)
-
-        st.write(f"Cophenetic Correlation Coefficient (CCC) untuk Dendrogram AHC (Complete): {ccc_complete:.4f}")
+    with lazy_expander("⬇ DENDROGRAM COMPLETE", key="lazy_dendrogram_complete") as opened:
+        if opened:
+            # Visualisasi Dendrogram untuk Complete
+            st.image(dendrogram_png(dataset_fingerprint(linkage_matrix_complete), 'Dendrogram AHC (Complete)', linkage_matrix_complete),
+                     use_column_width=True)
+
+            st.write(f"Cophenetic Correlation Coefficient (CCC) untuk Dendrogram AHC (Complete): {ccc_complete:.4f}")
        
 
 with st.expander("⬇ LINKAGE INFORMATION"):
@@ -238,23 +245,10 @@ silhouette_scores_complete = []
 n_clusters_range = range(2, 11)
 
 for n_clusters in n_clusters_range:
-    # Metode 'single'
-    clusterer_single = AgglomerativeClustering(n_clusters=n_clusters, linkage='single')
-    cluster_labels_single = clusterer_single.fit_predict(X_ahc)
-    silhouette_avg_single = silhouette_score(X_ahc, cluster_labels_single)
-    silhouette_scores_single.append(silhouette_avg_single)
-    
-    # Metode 'average'
-    clusterer_average = AgglomerativeClustering(n_clusters=n_clusters, linkage='average')
-    cluster_labels_average = clusterer_average.fit_predict(X_ahc)
-    silhouette_avg_average = silhouette_score(X_ahc, cluster_labels_average)
-    silhouette_scores_average.append(silhouette_avg_average)
-    
-    # Metode 'complete'
-    clusterer_complete = AgglomerativeClustering(n_clusters=n_clusters, linkage='complete')
-    cluster_labels_complete = clusterer_complete.fit_predict(X_ahc)
-    silhouette_avg_complete = silhouette_score(X_ahc, cluster_labels_complete)
-    silhouette_scores_complete.append(silhouette_avg_complete)
+    # Metode 'single', 'average' dan 'complete' (silhouette of each tree cut, from the sweep)
+    silhouette_scores_single.append(ahc_sweep['single']['silhouette'][n_clusters])
+    silhouette_scores_average.append(ahc_sweep['average']['silhouette'][n_clusters])
+    silhouette_scores_complete.append(ahc_sweep['complete']['silhouette'][n_clusters])
 
 # Create dataframes for silhouette scores
 silhouette_scores_single_df = pd.DataFrame({'Number of Clusters': n_clusters_range, 'Silhouette Score': silhouette_scores_single})
@@ -297,31 +291,33 @@ silhouette_df = pd.DataFrame({
 
 c1,c2 = st.columns(2)
 with c1:
-    with st.expander("⬇ PERBANDINGAN METODE SINGLE, AVERAGE DAN COMPLETE DENGAN COPHENETIC CORRELATION COEFFICIENT"):
-        # Membuat plot perbandingan CCC
-        fig_ccc = px.bar(ccc_comparison_df, x='Metode', y='CCC', 
-                        title='Perbandingan Cophenetic Correlation Coefficient (CCC)',
-                        labels={'CCC': 'Cophenetic Correlation Coefficient', 'Metode': 'Metode Clustering'},
-                        color='Metode',
+    with lazy_expander("⬇ PERBANDINGAN METODE SINGLE, AVERAGE DAN COMPLETE DENGAN COPHENETIC CORRELATION COEFFICIENT", key="lazy_ccc_comparison") as opened:
+        if opened:
+            # Membuat plot perbandingan CCC
+            fig_ccc = px.bar(ccc_comparison_df, x='Metode', y='CCC', 
+                            title='Perbandingan Cophenetic Correlation Coefficient (CCC)',
+                            labels={'CCC': 'Cophenetic Correlation Coefficient', 'Metode': 'Metode Clustering'},
+                            color='Metode',
+                            color_discrete_map={
+                                'Single': 'blue',
+                                'Average': 'green',
+                                'Complete': 'red'
+                            })
+
+            # Menampilkan plot
+            st.plotly_chart(fig_ccc)
+
+with c2:
+    with lazy_expander("⬇ PERBANDINGAN METODE SINGLE, AVERAGE DAN COMPLETE DENGAN SILLHOUTE SCORE", key="lazy_silhouette_comparison") as opened:
+        if opened:
+            fig = px.line(silhouette_df, x='Jumlah Cluster', y=['Single Linkage', 'Average Linkage', 'Complete Linkage'],
+                        labels={'value': 'Silhouette Score', 'variable': 'Metode'},
+                        title='Silhouette Score untuk Berbagai Jumlah Cluster',
                         color_discrete_map={
-                            'Single': 'blue',
-                            'Average': 'green',
-                            'Complete': 'red'
+                            'Single Linkage': 'blue',
+                            'Average Linkage': 'green',
+                            'Complete Linkage': 'red'
                         })
 
-        # Menampilkan plot
-        st.plotly_chart(fig_ccc)
-
-with c2:
-    with st.expander("⬇ PERBANDINGAN METODE SINGLE, AVERAGE DAN COMPLETE DENGAN SILLHOUTE SCORE"):
-        fig = px.line(silhouette_df, x='Jumlah Cluster', y=['Single Linkage', 'Average Linkage', 'Complete Linkage'],
-                    labels={'value': 'Silhouette Score', 'variable': 'Metode'},
-                    title='Silhouette Score untuk Berbagai Jumlah Cluster',
-                    color_discrete_map={
-                        'Single Linkage': 'blue',
-                        'Average Linkage': 'green',
-                        'Complete Linkage': 'red'
-                    })
-
-        # Tampilkan plot
-        st.plotly_chart(fig)
+            # Tampilkan plot
+            st.plotly_chart(fig)
@@ -1,13 +1,21 @@
 import streamlit as st
 import pandas as pd
-from sklearn.cluster import AgglomerativeClustering
-import geopandas as gpd
 import plotly.express as px
 import plotly.graph_objects as go
-import time
-from sklearn.metrics import silhouette_score
-from scipy.cluster.hierarchy import linkage, cophenet
-from scipy.spatial.distance import pdist
+from utils.clustering import (
+    AHC_K_RANGE, CLUSTER_FEATURES, ccc_job, density_categories, load_ahc_sweep, load_spatial_ahc_sweep,
+    load_trajectory_ahc_sweep,
+)
+from utils.data import (
+    geometry_asset_url, load_desa_index, load_geometry_tier, load_population_adjacency, load_population_cube, load_population_distances,
+    load_population_wide,
+)
+from utils.results import job_result
+from utils.figures import cached_figure, show_figure_cache_stats
+from utils.lazy import lazy_expander, lazy_tabs
+from utils.population import DESA_KEY
+from utils.progress import stage_progress
+from utils.stability import STABILITY_RESAMPLES, ahc_references, load_stability
 
 
 # Set page configuration
@@ -19,48 +27,28 @@ st.set_page_config(
 )
 
 # Function to perform Agglomerative Hierarchical Clustering
-def ahc_clustering(data, n_clusters, linkage):
-    features = data[['2011', '2012', '2013', '2014', '2015', '2016', '2017', '2018', '2019', '2020', '2021', '2022', '2023']]
-    
-    # Fit AgglomerativeClustering
-    clusterer = AgglomerativeClustering(n_clusters=n_clusters, linkage=linkage)
-    data['cluster'] = clusterer.fit_predict(features)
-    
-    # Calculate centroid for each cluster
-    centroids = data.groupby('cluster')[['2011', '2012', '2013', '2014', '2015', '2016', '2017', '2018', '2019', '2020', '2021', '2022', '2023']].mean()
+def ahc_clustering(data, cube, sweep, n_clusters, linkage):
+    # Clustering features: the shared desa x year population cube, rows aligned with data
+    features = cube['values']
+
+    # Work on a copy, the loaded data is shared between sessions
+    data = data.copy()
 
-        # Define threshold values (adjust these based on your analysis)
-    threshold_low = 3131.750000 # Example threshold for "not dense"
-    threshold_high = 5679.750000  # Example threshold for "dense"
+    # Labels for n_clusters, cut from the hierarchy built once per linkage method
+    data['cluster'] = sweep[linkage]['labels'][n_clusters]
 
-    # Add Density Category column based on centroid values
-    data['Density Category'] = data['cluster'].map(lambda cluster: 'Tidak Padat' if centroids.loc[cluster].mean() < threshold_low else ('Padat' if centroids.loc[cluster].mean() < threshold_high else 'Sangat Padat'))
+    # Add Density Category column based on the mean population of each cluster centroid
+    data['Density Category'] = density_categories(features, data['cluster'])
     
-    # After clustering, calculate silhouette score
-    silhouette_avg = silhouette_score(features, data['cluster'])
+    # Silhouette score of the selected clustering
+    silhouette_avg = sweep[linkage]['silhouette'][n_clusters]
 
     return data, silhouette_avg
 
-# Function to calculate CCC for different linkage methods
+# Function to calculate CCC for different linkage methods (single, average, complete), reused from
+# the on-disk result cache when these features were seen before
 def calculate_ccc(data):
-    numeric_data = data.select_dtypes(include=['float64', 'int64']).copy()
-
-    # Calculate CCC for 'single' linkage method
-    linkage_matrix_single = linkage(numeric_data, method='single')
-    cophenet_matrix_single, _ = cophenet(linkage_matrix_single, pdist(numeric_data))
-    ccc_single = cophenet_matrix_single.mean()
-
-    # Calculate CCC for 'average' linkage method
-    linkage_matrix_average = linkage(numeric_data, method='average')
-    cophenet_matrix_average, _ = cophenet(linkage_matrix_average, pdist(numeric_data))
-    ccc_average = cophenet_matrix_average.mean()
-
-    # Calculate CCC for 'complete' linkage method
-    linkage_matrix_complete = linkage(numeric_data, method='complete')
-    cophenet_matrix_complete, _ = cophenet(linkage_matrix_complete, pdist(numeric_data))
-    ccc_complete = cophenet_matrix_complete.mean()
-
-    return ccc_single, ccc_average, ccc_complete
+    return job_result(ccc_job(data))
 
 
 # Function to display CCC Progress Bar
@@ -69,7 +57,9 @@ def CCCProgressBar(score, target, metode):
 
     current = score
     percent = round((current / target * 100))
-    mybar = st.progress(0)
+
+    # The score is already computed, draw it at once
+    st.progress(min(max(percent, 0), 100), text="Persentase Skor")
 
     st.write(f"Metode yang dipilih: {metode}")
 
@@ -78,58 +68,86 @@ def CCCProgressBar(score, target, metode):
     else:
         st.write("Skor yang diCapai {:.2f}% dari skor target".format(percent))
 
-        for percent_complete in range(percent):
-            time.sleep(0.1)
-            mybar.progress(percent_complete + 1, text="Persentase Skor")
-    
+
+# Bootstrap stability of the selected clustering: mean ARI of the resample refits for every k, and how
+# often each desa stayed in its cluster
+def show_stability(stability, n_clusters, data):
+    st.write("Rata-rata ARI {} resample bootstrap untuk {} klaster: {:.3f}".format(
+        STABILITY_RESAMPLES, n_clusters, stability['ari'][n_clusters]))
+    ari = pd.DataFrame({'num_clusters': list(stability['ari']), 'ari': list(stability['ari'].values())})
+    fig_ari = px.line(ari, x='num_clusters', y='ari', markers=True, title='Stabilitas per Jumlah Klaster',
+                      labels={'num_clusters': 'Number of Clusters', 'ari': 'Mean ARI'})
+    st.plotly_chart(fig_ari, use_container_width=True)
+    confidence = data[['DESA_1', 'cluster']].assign(confidence=stability['confidence'][n_clusters])
+    st.dataframe(confidence.sort_values('confidence'),
+                 hide_index=True,
+                 use_container_width=True,
+                 column_config={
+                     "DESA_1": st.column_config.TextColumn("Area"),
+                     "confidence": st.column_config.ProgressColumn(
+                         "Keyakinan", format="%.2f", min_value=0, max_value=1,
+                     )}
+                 )
+
+
+# Zoom level of the cluster map, also selects the simplified geometry tier
+MAP_ZOOM = 9.5
+
 
 # Function to create GeoMap with Plotly Express
 def create_geomap(data, geojson_data, selected_color_theme):
-    # Merge GeoJSON data with clustered data based on 'DESA_1'
-    merged_data = geojson_data.merge(data, left_on='DESA_1', right_on='DESA_1')
+    # Merge GeoJSON data with clustered data on (DESA_1, KECAMATAN), keeping each row's polygon position
+    merged_data = geojson_data[DESA_KEY].assign(feature=range(len(geojson_data))).merge(data, on=DESA_KEY)
+
+    # Polygons served once as a static file when the server allows it, embedded in the figure otherwise
+    geometry_url = geometry_asset_url(MAP_ZOOM)
 
     # Sidebar to select 'DESA_1'
     selected_DESA = st.sidebar.selectbox("Pilih DESA_1", merged_data['DESA_1'].unique())
 
-    # Filter data for selected 'DESA_1'
-    filtered_df_DESA = merged_data[merged_data['DESA_1'] == selected_DESA]
-
-    # Get coordinates for the selected 'DESA_1'
-    selected_lon = filtered_df_DESA.geometry.centroid.x.values[0]
-    selected_lat = filtered_df_DESA.geometry.centroid.y.values[0]
-
-    # Plot GeoMap with Plotly Express
-    fig = px.choropleth_mapbox(
-        merged_data,
-        geojson=merged_data.geometry,
-        locations=merged_data.index,
-        hover_name='DESA_1',
-        color='cluster',
-        color_continuous_scale=selected_color_theme,
-        mapbox_style="carto-darkmatter",
-        zoom=9.5,
-        center={"lat": merged_data.geometry.centroid.y.mean(), "lon": merged_data.geometry.centroid.x.mean()},
-        labels={'cluster': 'Cluster'}
-    )
-
-    # Add marker for the selected 'DESA_1'
-    fig.add_trace(go.Scattermapbox(
-        mode="markers+text",
-        lon=[selected_lon],
-        lat=[selected_lat],
-        marker=dict(size=14, color="red"),
-        text=[selected_DESA],
-        hoverinfo='text',
-        showlegend=False
-    ))
-
-    # Set the map layout
-    fig.update_layout(
-        autosize=True,
-        margin=dict(l=0, r=0, t=0, b=0),
+    def build():
+        # Get coordinates for the selected 'DESA_1' from the precomputed centroid index
+        desa_index = load_desa_index()
+        selected_lon = desa_index['desa'][selected_DESA]['lon']
+        selected_lat = desa_index['desa'][selected_DESA]['lat']
+
+        # Plot GeoMap with Plotly Express
+        fig = px.choropleth_mapbox(
+            merged_data,
+            geojson=geometry_url or geojson_data.geometry,
+            locations='feature',
+            hover_name='DESA_1',
+            color='cluster',
+            color_continuous_scale=selected_color_theme,
+            mapbox_style="carto-darkmatter",
+            zoom=MAP_ZOOM,
+            center=desa_index['center'],
+            labels={'cluster': 'Cluster'}
+        )
+
+        # Add marker for the selected 'DESA_1'
+        fig.add_trace(go.Scattermapbox(
+            mode="markers+text",
+            lon=[selected_lon],
+            lat=[selected_lat],
+            marker=dict(size=14, color="red"),
+            text=[selected_DESA],
+            hoverinfo='text',
+            showlegend=False
+        ))
+
+        # Set the map layout
+        fig.update_layout(
+            autosize=True,
+            margin=dict(l=0, r=0, t=0, b=0),
+        )
+        return fig
+
+    # Show the GeoMap, rebuilt only when the clusters, theme or selected desa change
+    fig = cached_figure(
+        'cluster_map', build, data[DESA_KEY + ['cluster']],
+        theme=selected_color_theme, desa=selected_DESA, zoom=MAP_ZOOM, geometry=geometry_url,
     )
-
-    # Show the GeoMap
     st.plotly_chart(fig, use_container_width=True)
 
 
@@ -144,17 +162,39 @@ def ahc_page():
     # Sidebar: Choose the linkage type
     linkage = st.sidebar.selectbox("Linkage Type", ['complete', 'single', 'average'])
 
-    # Select Year in the Sidebar
-    st.session_state.selected_year = st.sidebar.selectbox('Select Year', ['2011', '2012', '2013', '2014', '2015', '2016', '2017', '2018', '2019', '2020', '2021', '2022', '2023'])
+    # Sidebar: only let desa that share a border merge, so every cluster is one contiguous region
+    spatial = st.sidebar.toggle("Spatial AHC (hanya desa bertetangga)")
+
+    # Sidebar: cluster on population size per year, or on the shape of each desa's growth curve (DTW)
+    cluster_features = st.sidebar.selectbox("Fitur Klaster", CLUSTER_FEATURES, key="cluster_features_selector")
+
+    # Loading stages behind one progress bar, each advances it when done (instant when cached)
+    advance = stage_progress(["Memuat data populasi", "Membangun hierarki AHC", "Menghitung CCC"])
 
     # Load data from the home page
-    data_from_homepage = pd.read_csv('AUDIT-Data_Original_Update.csv')  # Replace with your actual data
+    data_from_homepage = load_population_wide()
+    population_cube = load_population_cube()
+    population_distances = load_population_distances()
+    advance()
+
+    # One tree per linkage method cut for every k, with the silhouette of each cut (shared between sessions)
+    if cluster_features == 'trajectory':
+        ahc_sweep = load_trajectory_ahc_sweep(population_cube, load_population_adjacency() if spatial else None)
+    elif spatial:
+        ahc_sweep = load_spatial_ahc_sweep(population_cube, load_population_adjacency(), population_distances)
+    else:
+        ahc_sweep = load_ahc_sweep(population_cube['values'], population_distances)
+    advance()
+
+    # Select Year in the Sidebar
+    st.session_state.selected_year = st.sidebar.selectbox('Select Year', population_cube['years'])
 
      # Perform Agglomerative Hierarchical Clustering
-    df_clustered, silhouette_avg = ahc_clustering(data_from_homepage, n_clusters, linkage)
+    df_clustered, silhouette_avg = ahc_clustering(data_from_homepage, population_cube, ahc_sweep, n_clusters, linkage)
 
     # Calculate CCC for different linkage methods
     ccc_single, ccc_average, ccc_complete = calculate_ccc(data_from_homepage)
+    advance()
 
     # Save the clustered data and silhouette score in session_state
     st.session_state.df_clustered = df_clustered
@@ -164,9 +204,14 @@ def ahc_page():
 
     
 
-    tab1, tab2, tab3 = st.tabs(["DATASET", "VISUALISASI MAP", "SILLHOUTE SCORE FOR AHC METODE"])
+    # Theme color selection for GeoMap (outside the map section, so the choice survives switching sections)
+    color_theme_list = ['Blues', 'cividis', 'Greens', 'inferno', 'magma', 'plasma', 'reds', 'rainbow', 'turbo', 'viridis']
+    selected_color_theme = st.sidebar.selectbox('Pilih tema warna', color_theme_list, key="geo_map_color_theme_selector")
+
+    # Only the selected section runs
+    tab = lazy_tabs(["DATASET", "VISUALISASI MAP", "SILLHOUTE SCORE FOR AHC METODE"], key="ahc_page_tab")
 
-    with tab1:
+    if tab == "DATASET":
         
         # Menampilkan Progress Bar CCC berdasarkan jenis linkage yang dipilih
         if linkage == 'single':
@@ -176,6 +221,15 @@ def ahc_page():
         elif linkage == 'complete':
             CCCProgressBar(st.session_state.ccc_complete, target=1.0, metode='complete')
 
+        # How reproducible the clusters are under resampling
+        # (of the unconstrained population clustering; resampled only once the section is opened, then
+        # shared between sessions)
+        if cluster_features == 'population' and not spatial:
+            with lazy_expander("⬇ STABILITAS KLASTER (BOOTSTRAP)", key="lazy_stability") as opened:
+                if opened:
+                    stability = load_stability(population_cube, ahc_references(ahc_sweep), population_distances)
+                    show_stability(stability[linkage], n_clusters, df_clustered)
+
         # Menampilkan metrik untuk setiap klaster
         for cluster_num in range(n_clusters):
             # Get the density category for the current cluster
@@ -204,14 +258,9 @@ def ahc_page():
                                 )}
                             )
 
-    with tab2:
-        # Load GeoJSON file
-        geojson_path = 'andy.geojson'
-        geojson_data = gpd.read_file(geojson_path)
-
-        # Theme color selection for GeoMap
-        color_theme_list = ['Blues', 'cividis', 'Greens', 'inferno', 'magma', 'plasma', 'reds', 'rainbow', 'turbo', 'viridis']
-        selected_color_theme = st.sidebar.selectbox('Pilih tema warna', color_theme_list, key="geo_map_color_theme_selector")
+    if tab == "VISUALISASI MAP":
+        # Load GeoJSON file (cached once per server process, simplified for MAP_ZOOM)
+        geojson_data = load_geometry_tier(MAP_ZOOM)
 
         with st.expander('Desa Maps View Analitycs Clustering', expanded=True):
             create_geomap(df_clustered, geojson_data, selected_color_theme)
@@ -231,47 +280,55 @@ def ahc_page():
         with col1:
             with st.container(border=True):
                 # Simple line chart showing the count of data points in each cluster
-                cluster_counts = df_clustered['cluster'].value_counts().sort_index()
-                fig_cluster_counts = px.line(
-                    x=cluster_counts.index,
-                    y=cluster_counts.values,
-                    labels={'x': 'Cluster', 'y': 'Data Point Count'},
-                    title='<b>Data Point Count by Cluster</b>',
-                    line_shape="linear",
-                    render_mode="svg",
-                    markers=True
-                )
-                fig_cluster_counts.update_layout(
-                    plot_bgcolor='rgba(0, 0, 0, 0)',  # Set plot background color to transparent
-                    paper_bgcolor='rgba(0, 0, 0, 0)',  # Set paper background color to transparent
-                    xaxis=dict(showgrid=True, gridcolor='#cecdcd'),  # Show x-axis grid and set its color
-                    yaxis=dict(showgrid=True, gridcolor='#cecdcd'),  # Show y-axis grid and set its color
-                    font=dict(color='#cecdcd'),  # Set text color to black
-                )
+                def build():
+                    cluster_counts = df_clustered['cluster'].value_counts().sort_index()
+                    fig_cluster_counts = px.line(
+                        x=cluster_counts.index,
+                        y=cluster_counts.values,
+                        labels={'x': 'Cluster', 'y': 'Data Point Count'},
+                        title='<b>Data Point Count by Cluster</b>',
+                        line_shape="linear",
+                        render_mode="svg",
+                        markers=True
+                    )
+                    fig_cluster_counts.update_layout(
+                        plot_bgcolor='rgba(0, 0, 0, 0)',  # Set plot background color to transparent
+                        paper_bgcolor='rgba(0, 0, 0, 0)',  # Set paper background color to transparent
+                        xaxis=dict(showgrid=True, gridcolor='#cecdcd'),  # Show x-axis grid and set its color
+                        yaxis=dict(showgrid=True, gridcolor='#cecdcd'),  # Show y-axis grid and set its color
+                        font=dict(color='#cecdcd'),  # Set text color to black
+                    )
+                    return fig_cluster_counts
+                fig_cluster_counts = cached_figure('cluster_counts', build, df_clustered['cluster'])
                 st.plotly_chart(fig_cluster_counts, use_container_width=True)
                 
         with col2:
             with st.container(border=True):
                 # Create a donut chart
-                fig = px.pie(df_clustered, names='cluster', title='Cluster Distribution')
-                fig.update_traces(hole=0.4)  # Set the size of the hole in the middle for a donut chart
-                fig.update_layout(width=800)
+                def build():
+                    fig = px.pie(df_clustered, names='cluster', title='Cluster Distribution')
+                    fig.update_traces(hole=0.4)  # Set the size of the hole in the middle for a donut chart
+                    fig.update_layout(width=800)
+                    return fig
+                fig = cached_figure('cluster_donut', build, df_clustered['cluster'])
                 st.plotly_chart(fig, use_container_width=True)
 
         with col3:
             with st.container(border=True):
-                fig2 = go.Figure(
-                    data=[go.Bar(x=df_clustered['cluster'], y=df_clustered[st.session_state.selected_year])],
-                    layout=go.Layout(
-                        title=go.layout.Title(text=f"Population Distribution by Cluster for {st.session_state.selected_year}"),
-                        plot_bgcolor='rgba(0, 0, 0, 0)',  # Set plot background color to transparent
-                        paper_bgcolor='rgba(0, 0, 0, 0)',  # Set paper background color to transparent
-                        xaxis=dict(showgrid=True, gridcolor='#cecdcd'),  # Show x-axis grid and set its color
-                        yaxis=dict(showgrid=True, gridcolor='#cecdcd'),  # Show y-axis grid and set its color
-                        font=dict(color='#cecdcd'),  # Set text color to black
+                def build():
+                    fig2 = go.Figure(
+                        data=[go.Bar(x=df_clustered['cluster'], y=df_clustered[st.session_state.selected_year])],
+                        layout=go.Layout(
+                            title=go.layout.Title(text=f"Population Distribution by Cluster for {st.session_state.selected_year}"),
+                            plot_bgcolor='rgba(0, 0, 0, 0)',  # Set plot background color to transparent
+                            paper_bgcolor='rgba(0, 0, 0, 0)',  # Set paper background color to transparent
+                            xaxis=dict(showgrid=True, gridcolor='#cecdcd'),  # Show x-axis grid and set its color
+                            yaxis=dict(showgrid=True, gridcolor='#cecdcd'),  # Show y-axis grid and set its color
+                            font=dict(color='#cecdcd'),  # Set text color to black
+                        )
                     )
-                )
-
+                    return fig2
+                fig2 = cached_figure('cluster_population', build, df_clustered[['cluster', st.session_state.selected_year]], year=st.session_state.selected_year)
                 st.plotly_chart(fig2, use_container_width=True)
                 
 
@@ -311,19 +368,15 @@ def ahc_page():
                 - Penggunaan metode AHC memerlukan pertimbangan parameter dan pemilihan metode linkage yang sesuai.
 
             Terima kasih telah menggunakan aplikasi ini. Semoga hasil analisis ini bermanfaat untuk pengambilan keputusan dan pengembangan wilayah.
-            '''.format(n_clusters, linkage, silhouette_score))
-    with tab3:
+            '''.format(n_clusters, linkage, silhouette_avg))
+    if tab == "SILLHOUTE SCORE FOR AHC METODE":
         col1, col2 = st.columns(2)
 
         # Prepare silhouette score data for different linkage methods
         silhouette_scores = []
-        cluster_range = range(2, 51)
+        cluster_range = AHC_K_RANGE
         for method in ['single', 'average', 'complete']:
-            scores = []
-            for n in cluster_range:
-                _, score = ahc_clustering(data_from_homepage, n_clusters=n, linkage=method)
-                scores.append(score)
-            silhouette_scores.append(scores)
+            silhouette_scores.append([ahc_sweep[method]['silhouette'][n] for n in cluster_range])
 
         silhouette_df = pd.DataFrame({
             'Jumlah Cluster': cluster_range,
@@ -334,18 +387,21 @@ def ahc_page():
 
         with col1:
             # Display line plot for silhouette scores for different linkage methods
-            fig = px.line(
-                silhouette_df,
-                x='Jumlah Cluster',
-                y=['Single Linkage', 'Average Linkage', 'Complete Linkage'],
-                labels={'value': 'Silhouette Score', 'variable': 'Metode'},
-                title='Silhouette Score untuk Berbagai Jumlah Cluster',
-                color_discrete_map={
-                    'Single Linkage': 'blue',
-                    'Average Linkage': 'green',
-                    'Complete Linkage': 'red'
-                }
-            )
+            def build():
+                fig = px.line(
+                    silhouette_df,
+                    x='Jumlah Cluster',
+                    y=['Single Linkage', 'Average Linkage', 'Complete Linkage'],
+                    labels={'value': 'Silhouette Score', 'variable': 'Metode'},
+                    title='Silhouette Score untuk Berbagai Jumlah Cluster',
+                    color_discrete_map={
+                        'Single Linkage': 'blue',
+                        'Average Linkage': 'green',
+                        'Complete Linkage': 'red'
+                    }
+                )
+                return fig
+            fig = cached_figure('linkage_silhouette', build, silhouette_df)
             st.plotly_chart(fig, use_container_width=True)
 
         with col2:
@@ -353,7 +409,7 @@ def ahc_page():
             selected_clusters = st.selectbox("Number of Clusters", cluster_range)
             linkage_method = st.selectbox("Linkage Method", ['single', 'average', 'complete'])
             
-            df_selected_clusters, silhouette_selected = ahc_clustering(data_from_homepage, n_clusters=selected_clusters, linkage=linkage_method)
+            df_selected_clusters, silhouette_selected = ahc_clustering(data_from_homepage, population_cube, ahc_sweep, n_clusters=selected_clusters, linkage=linkage_method)
             st.write(f"Silhouette Score for {selected_clusters} clusters using {linkage_method} linkage: {silhouette_selected}")
 
 
@@ -363,3 +419,4 @@ def ahc_page():
 if __name__ == "__main__":
     # Call the ahc_page function
     ahc_page()
+    show_figure_cache_stats()
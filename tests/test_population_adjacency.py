@@ -0,0 +1,52 @@
+import os
+
+import pandas as pd
+import pytest
+
+from utils.data import GEOJSON_PATH, POPULATION_WIDE_PATH, population_adjacency
+from utils.geo import build_adjacency, read_geometry
+from utils.population import desa_keys, prepare_population
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+@pytest.fixture(scope='module')
+def sources():
+    wide = prepare_population(pd.read_csv(os.path.join(ROOT, POPULATION_WIDE_PATH)))
+    gdf = read_geometry(os.path.join(ROOT, GEOJSON_PATH))
+    return wide, gdf
+
+
+def _neighbours(adjacency, row):
+    return set(adjacency[row].indices)
+
+
+# Each namesake row gets the neighbours of its own kecamatan's polygon, whatever order the CSV and
+# the GeoJSON list the namesakes in
+@pytest.mark.parametrize('name, kecamatan', [
+    ('CIBODAS', 'SUKATANI'), ('CIBODAS', 'BUNGURSARI'),
+    ('CITALANG', 'PURWAKARTA'), ('CITALANG', 'TEGAL WARU'),
+    ('PASANGGRAHAN', 'BOJONG'), ('PASANGGRAHAN', 'TEGAL WARU'),
+])
+def test_namesake_gets_its_own_kecamatan_neighbours(sources, name, kecamatan):
+    wide, gdf = sources
+    rows, polygons = desa_keys(wide), desa_keys(gdf)
+    row = rows.get_loc((name, kecamatan))
+    polygon = polygons.get_loc((name, kecamatan))
+
+    expected = {
+        rows.get_loc(key) for key in polygons[list(_neighbours(build_adjacency(gdf), polygon))] if key in rows
+    }
+    neighbours = _neighbours(population_adjacency(wide, gdf), row)
+    assert expected
+    assert neighbours == expected
+    assert kecamatan in set(wide['KECAMATAN'].iloc[list(neighbours)])
+
+
+def test_namesakes_do_not_share_neighbours(sources):
+    wide, gdf = sources
+    rows = desa_keys(wide)
+    adjacency = population_adjacency(wide, gdf)
+    sukatani = _neighbours(adjacency, rows.get_loc(('CIBODAS', 'SUKATANI')))
+    bungursari = _neighbours(adjacency, rows.get_loc(('CIBODAS', 'BUNGURSARI')))
+    assert not sukatani & bungursari
@@ -0,0 +1,85 @@
+import datetime
+import hashlib
+import json
+import os
+
+import numpy as np
+
+# Build outputs derived from the source files, rebuilt with `python -m utils.build`
+ARTIFACT_DIR = 'artifacts'
+MANIFEST_PATH = os.path.join(ARTIFACT_DIR, 'manifest.json')
+
+
+def artifact_path(name):
+    return os.path.join(ARTIFACT_DIR, name)
+
+
+# Content hash of a file, used to tell whether an artifact was built from the current source
+def file_sha256(path):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1 << 20), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def read_manifest():
+    try:
+        with open(MANIFEST_PATH) as f:
+            return json.load(f)
+    except (FileNotFoundError, json.JSONDecodeError):
+        return {}
+
+
+# Remember which source (and which version of it) an artifact was built from, plus any details
+def record_artifact(name, source, **details):
+    manifest = read_manifest()
+    manifest[name] = {
+        'source': source,
+        'source_sha256': file_sha256(source),
+        'built_at': datetime.datetime.now().isoformat(timespec='seconds'),
+        **details,
+    }
+    os.makedirs(ARTIFACT_DIR, exist_ok=True)
+    tmp_path = MANIFEST_PATH + '.tmp'
+    with open(tmp_path, 'w') as f:
+        json.dump(manifest, f, indent=2, sort_keys=True)
+    os.replace(tmp_path, MANIFEST_PATH)
+
+
+# An artifact is fresh when it exists and the source still hashes to what it was built from
+def is_fresh(name, source):
+    entry = read_manifest().get(name)
+    if entry is None or not os.path.exists(artifact_path(name)):
+        return False
+    return entry['source'] == source and entry['source_sha256'] == file_sha256(source)
+
+
+# Write a set of named arrays as one .npz artifact built from source
+def save_npz_artifact(name, source, **arrays):
+    os.makedirs(ARTIFACT_DIR, exist_ok=True)
+    path = artifact_path(name)
+    np.savez(path, **arrays)
+    record_artifact(name, source)
+    return path
+
+
+# Write one array as a .npy artifact built from source. The file is swapped in atomically, so a
+# process that still maps the previous version keeps reading it intact until it reopens.
+def save_npy_artifact(name, source, array, **details):
+    os.makedirs(ARTIFACT_DIR, exist_ok=True)
+    path = artifact_path(name)
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'wb') as f:
+        np.save(f, np.ascontiguousarray(array))
+    os.replace(tmp_path, path)
+    record_artifact(name, source, **details)
+    return path
+
+
+# Read-only memory map of a .npy artifact, or None when it is missing or stale. Every process that
+# maps the same file shares its pages through the OS page cache instead of holding a private copy.
+def open_npy_artifact(name, source):
+    if not is_fresh(name, source):
+        return None
+    return np.load(artifact_path(name), mmap_mode='r')
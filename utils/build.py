@@ -0,0 +1,58 @@
+import argparse
+import time
+
+from utils.artifacts import is_fresh, read_manifest
+from utils.clustering import KMEANS_ARTIFACT, build_kmeans_artifact
+from utils.data import (
+    DISTANCES_ARTIFACT, FEATURES_ARTIFACT, GEOJSON_PATH, POPULATION_LONG_PATH, POPULATION_WIDE_PATH, YEAR_CORRELATION_ARTIFACT,
+    build_features_artifact, build_year_correlation_artifact,
+)
+from utils.geo import GEOMETRY_ARTIFACT, TIER_ZOOMS, build_geometry_artifact, build_tier_artifacts, read_geometry, tier_artifact
+from utils.population import DATASET_ARTIFACT, build_dataset_artifact, export_long_csv, read_population
+
+
+# The dataset checks also compare the (desa, kecamatan) list with the map polygons; the long CSV export is
+# regenerated from the validated dataset so the two layouts cannot drift apart
+def build_dataset(source):
+    path = build_dataset_artifact(source, polygons=read_geometry(GEOJSON_PATH))
+    export_long_csv(read_population(source), POPULATION_LONG_PATH)
+    return [path, POPULATION_LONG_PATH]
+
+
+# step -> (artifact names, source file, builder), in dependency order
+BUILD_STEPS = {
+    'geometry': ([GEOMETRY_ARTIFACT], GEOJSON_PATH, build_geometry_artifact),
+    'tiers': ([tier_artifact(zoom) for zoom in TIER_ZOOMS], GEOJSON_PATH, build_tier_artifacts),
+    'dataset': ([DATASET_ARTIFACT], POPULATION_WIDE_PATH, build_dataset),
+    'features': ([FEATURES_ARTIFACT, DISTANCES_ARTIFACT], POPULATION_WIDE_PATH, build_features_artifact),
+    'correlation': ([YEAR_CORRELATION_ARTIFACT], POPULATION_WIDE_PATH, build_year_correlation_artifact),
+    'kmeans': ([KMEANS_ARTIFACT], POPULATION_WIDE_PATH, build_kmeans_artifact),
+}
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Build the precomputed artifacts used by the app.')
+    parser.add_argument('steps', nargs='*', help=f"steps to run, any of {', '.join(BUILD_STEPS)} (default: all)")
+    parser.add_argument('--force', action='store_true', help='rebuild even if the artifact is fresh')
+    args = parser.parse_args(argv)
+    unknown = set(args.steps) - set(BUILD_STEPS)
+    if unknown:
+        parser.error(f"unknown step(s): {', '.join(sorted(unknown))}")
+
+    for step in args.steps or BUILD_STEPS:
+        names, source, builder = BUILD_STEPS[step]
+        if not args.force and all(is_fresh(name, source) for name in names):
+            print(f"{step}: {', '.join(names)} up to date")
+            continue
+        start = time.perf_counter()
+        paths = builder(source)
+        if isinstance(paths, str):
+            paths = [paths]
+        print(f"{step}: built {', '.join(paths)} in {time.perf_counter() - start:.2f}s")
+        for name in names:
+            for warning in read_manifest()[name].get('warnings', []):
+                print(f'{step}: warning: {warning}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,412 @@
+import multiprocessing
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import numpy as np
+import streamlit as st
+from scipy.cluster.hierarchy import cophenet, cut_tree, linkage
+from sklearn.cluster import AgglomerativeClustering, KMeans, MiniBatchKMeans
+from sklearn.metrics import silhouette_score
+
+from utils.artifacts import artifact_path, is_fresh, save_npz_artifact
+from utils.data import build_population_cube
+from utils.distances import condensed_distances, dataset_fingerprint, default_sample_size, estimate_silhouette, square_distances
+from utils.population import read_population
+from utils.results import job_result
+from utils.trajectory import DTW_WINDOW, dtw_distances, growth_curves
+
+# Thresholds on the mean yearly population of a cluster centroid (adjust these based on your analysis)
+DENSITY_THRESHOLD_LOW = 3131.75  # below: "Tidak Padat"
+DENSITY_THRESHOLD_HIGH = 5679.75  # below: "Padat", otherwise "Sangat Padat"
+
+# Cluster counts used by the KMeans pages (k = 1 only appears on the elbow curves)
+KMEANS_K_RANGE = range(1, 11)
+KMEANS_ARTIFACT = 'kmeans_centroids.npz'
+
+# KMeans backends: 'full' is batch Lloyd over every row, 'minibatch' updates the centroids from
+# random batches of rows and scales to national desa lists. 'auto' picks minibatch from
+# MINIBATCH_MIN_ROWS rows on.
+KMEANS_BACKENDS = ('auto', 'full', 'minibatch')
+MINIBATCH_MIN_ROWS = 20000
+MINIBATCH_BATCH_SIZE = 4096
+
+# Linkage methods and cluster counts offered by the AHC page
+AHC_LINKAGES = ('single', 'average', 'complete')
+AHC_K_RANGE = range(2, 51)
+
+# What the pages cluster desa on: 'population' is the yearly population as independent Euclidean
+# dimensions (mostly separates desa by size), 'trajectory' the growth curves under DTW (see
+# utils.trajectory), which separates them by how they grew
+CLUSTER_FEATURES = ('population', 'trajectory')
+
+# DTW KMeans rounds of assignment and centroid update after the Euclidean start
+TRAJECTORY_MAX_ITER = 30
+
+# Below this many rows a k-sweep runs in-process: starting the worker pool costs more than the fits
+SWEEP_POOL_MIN_ROWS = 5000
+
+
+# Density category of every row, from the mean over all years of its cluster centroid
+def density_categories(values, labels):
+    labels = np.asarray(labels)
+    counts = np.bincount(labels)
+    centroid_means = np.bincount(labels, weights=values.mean(axis=1)) / np.maximum(counts, 1)
+    means = centroid_means[labels]
+    return np.select(
+        [means < DENSITY_THRESHOLD_LOW, means < DENSITY_THRESHOLD_HIGH],
+        ['Tidak Padat', 'Padat'],
+        'Sangat Padat',
+    )
+
+
+# Concrete backend for a dataset of n rows
+def resolve_kmeans_backend(backend, n):
+    if backend not in KMEANS_BACKENDS:
+        raise ValueError(f"unknown KMeans backend {backend!r}, expected one of {', '.join(KMEANS_BACKENDS)}")
+    if backend == 'auto':
+        return 'minibatch' if n >= MINIBATCH_MIN_ROWS else 'full'
+    return backend
+
+
+# KMeans as configured on the pages; with init the fit starts from those centroids instead of k-means++
+def fit_kmeans(values, k, init=None, backend='full'):
+    if backend == 'minibatch':
+        # No reassignment: the few very populous desa form small clusters that must not be recycled
+        options = dict(batch_size=MINIBATCH_BATCH_SIZE, reassignment_ratio=0, random_state=42)
+        if init is None:
+            return MiniBatchKMeans(n_clusters=k, n_init=3, **options).fit(values)
+        return MiniBatchKMeans(n_clusters=k, init=init, n_init=1, **options).fit(values)
+    if init is None:
+        return KMeans(n_clusters=k, random_state=42).fit(values)
+    return KMeans(n_clusters=k, init=init, n_init=1, random_state=42).fit(values)
+
+
+# Index of the nearest centroid for every row
+def nearest_centroid(values, centroids):
+    distances = ((values[:, None, :] - centroids[None, :, :]) ** 2).sum(axis=2)
+    return distances.argmin(axis=1)
+
+
+# Refit after new year columns were appended to values: rows keep the cluster they had under the
+# old centroids, and the new coordinates of every centroid start at its members' mean
+def warm_start_kmeans(values, centroids):
+    old_columns = centroids.shape[1]
+    labels = nearest_centroid(values[:, :old_columns], centroids)
+    new_part = values[:, old_columns:]
+    counts = np.bincount(labels, minlength=len(centroids))[:, None]
+    sums = np.zeros((len(centroids), new_part.shape[1]))
+    np.add.at(sums, labels, new_part)
+    extension = np.where(counts > 0, sums / np.maximum(counts, 1), new_part.mean(axis=0))
+    return fit_kmeans(values, len(centroids), init=np.hstack([centroids, extension]))
+
+
+def save_kmeans_centroids(models, years, source):
+    arrays = {'years': np.array(years)}
+    for k, model in models.items():
+        arrays[f'centroids_{k}'] = model.cluster_centers_
+        arrays[f'inertia_{k}'] = model.inertia_
+        arrays[f'n_iter_{k}'] = model.n_iter_
+    return save_npz_artifact(KMEANS_ARTIFACT, source, **arrays)
+
+
+# Build step: KMeans centroids for every k the pages use, the seed for incremental refits
+def build_kmeans_artifact(source):
+    cube = build_population_cube(read_population(source))
+    models = {k: fit_kmeans(cube['values'], k) for k in KMEANS_K_RANGE}
+    return save_kmeans_centroids(models, cube['years'], source)
+
+
+# {k: centroids} from the artifact, or None when it is missing or stale
+def read_kmeans_centroids(source):
+    if not is_fresh(KMEANS_ARTIFACT, source):
+        return None
+    with np.load(artifact_path(KMEANS_ARTIFACT)) as artifact:
+        return {k: artifact[f'centroids_{k}'] for k in KMEANS_K_RANGE if f'centroids_{k}' in artifact}
+
+
+# One point of the k-sweep: a single fit gives the inertia, the labels and (k > 1) the silhouette.
+# distances (square) may be None on large inputs, the silhouette is then streamed blockwise (and sampled).
+def _sweep_k(values, distances, k, init=None, backend='full'):
+    start = time.perf_counter()
+    model = fit_kmeans(values, k, init=init, backend=backend)
+    seconds = time.perf_counter() - start
+    silhouette, interval = np.nan, None
+    if k > 1:
+        silhouette, interval = estimate_silhouette(values, model.labels_, distances, default_sample_size(len(values)))
+    return k, {
+        'inertia': model.inertia_, 'labels': model.labels_, 'centroids': model.cluster_centers_,
+        'n_iter': model.n_iter_, 'seconds': seconds, 'silhouette': silhouette, 'silhouette_interval': interval,
+    }
+
+
+# Fit every k once, {k: {'inertia', 'labels', 'centroids', 'n_iter', 'seconds', 'start', 'silhouette',
+# 'silhouette_interval'}}; the interval is None unless the silhouette was sampled (see
+# utils.distances.estimate_silhouette). Each fit starts from 'seeds', the centroids given for that k
+# (the centroid artifact, itself a cold fit of the same data), or 'cold', k-means++ as in fit_kmeans.
+# distances are the condensed distances of values, or None on large inputs. progress(done, total) is
+# called as each k finishes. Large inputs are spread over a process pool; spawned workers because the
+# Streamlit server is multi-threaded.
+def kmeans_sweep(values, distances, k_range=KMEANS_K_RANGE, seeds=None, backend='auto', workers=None, progress=None):
+    backend = resolve_kmeans_backend(backend, len(values))
+    distances = None if distances is None else square_distances(distances)
+    seeds = {k: centroids for k, centroids in (seeds or {}).items() if centroids.shape[1] == values.shape[1]}
+    jobs = [(k, seeds.get(k)) for k in k_range]
+    workers = min(workers or os.cpu_count() or 1, len(jobs))
+    sweep = {}
+    if workers == 1 or len(values) < SWEEP_POOL_MIN_ROWS:
+        for k, init in jobs:
+            sweep.update([_sweep_k(values, distances, k, init, backend)])
+            sweep[k]['start'] = 'seeds' if init is not None else 'cold'
+            if progress is not None:
+                progress(len(sweep), len(jobs))
+        return sweep
+    values = np.asarray(values)
+    with ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context('spawn')) as pool:
+        futures = [pool.submit(_sweep_k, values, distances, k, init, backend) for k, init in jobs]
+        for future in as_completed(futures):
+            k, result = future.result()
+            sweep[k] = {**result, 'start': 'seeds' if seeds.get(k) is not None else 'cold'}
+            if progress is not None:
+                progress(len(sweep), len(jobs))
+    return dict(sorted(sweep.items()))
+
+
+# Result-cache job (see utils.results) of a KMeans k-sweep; the key includes the seeds the fits start from
+def kmeans_sweep_job(values, distances, backend='auto', source=None):
+    backend = resolve_kmeans_backend(backend, len(values))
+    seeds = read_kmeans_centroids(source) if source is not None else None
+
+    def compute():
+        return kmeans_sweep(values, distances, seeds=seeds, backend=backend)
+
+    seeds_fingerprint = dataset_fingerprint(np.concatenate(list(seeds.values()))) if seeds else None
+    params = {'backend': backend, 'k_range': list(KMEANS_K_RANGE), 'seeds': seeds_fingerprint}
+    return 'kmeans_sweep', dataset_fingerprint(values), params, compute
+
+
+# In memory per process, on disk across restarts; the in-process entry keeps whichever seeding ran
+# first. A cached function cannot drive a progress bar created by the page, so a spinner is shown instead.
+@st.cache_resource(show_spinner="Fitting KMeans for every number of clusters...", max_entries=4)
+def _cached_kmeans_sweep(fingerprint, backend, _values, _distances, _source):
+    return job_result(kmeans_sweep_job(_values, _distances, backend, _source))
+
+
+# k-sweep of a population cube over KMEANS_K_RANGE, computed once per dataset and backend and shared by
+# every session and page; source, when given, seeds the fits from its centroid artifact. Treat the
+# result as read-only.
+def load_kmeans_sweep(cube, distances, source=None, backend='auto'):
+    values = cube['values']
+    backend = resolve_kmeans_backend(backend, len(values))
+    return _cached_kmeans_sweep(dataset_fingerprint(values), backend, values, distances, source)
+
+
+# Row of every cluster with the least summed squared DTW distance to the other members, read from the
+# square DTW matrix; an emptied cluster keeps its previous medoid
+def _dtw_medoids(distances, labels, medoids):
+    medoids = medoids.copy()
+    for cluster in range(len(medoids)):
+        members = np.flatnonzero(labels == cluster)
+        if len(members):
+            medoids[cluster] = members[(distances[np.ix_(members, members)] ** 2).sum(axis=1).argmin()]
+    return medoids
+
+
+# KMeans of growth curves under DTW. The arithmetic mean of curves is not their DTW centre, so the
+# clusters are represented by medoids: starting from the Euclidean KMeans of the curves, the DTW
+# assignment and the medoid update alternate while the DTW inertia keeps falling. Medoids are rows, so
+# both steps only read distances, the square DTW matrix of the curves.
+# Same layout as one k of kmeans_sweep ('centroids' are the medoid curves).
+def fit_trajectory_kmeans(curves, distances, k, max_iter=TRAJECTORY_MAX_ITER):
+    start = time.perf_counter()
+    labels = fit_kmeans(curves, k).labels_
+    medoids = np.zeros(k, dtype=int)
+    best = None
+    for n_iter in range(1, max_iter + 1):
+        medoids = _dtw_medoids(distances, labels, medoids)
+        to_medoids = distances[:, medoids]
+        labels = to_medoids.argmin(axis=1)
+        inertia = (to_medoids[np.arange(len(curves)), labels].astype(np.float64) ** 2).sum()
+        if best is not None and inertia >= best['inertia']:
+            break
+        best = {'inertia': inertia, 'labels': labels, 'centroids': curves[medoids], 'n_iter': n_iter}
+    return {**best, 'seconds': time.perf_counter() - start}
+
+
+# Trajectory counterpart of kmeans_sweep: {k: result of fit_trajectory_kmeans with 'start', 'silhouette',
+# and 'silhouette_interval'}, silhouettes on the DTW distances
+def trajectory_kmeans_sweep(values, k_range=KMEANS_K_RANGE, window=DTW_WINDOW):
+    curves = growth_curves(values)
+    distances = square_distances(dtw_distances(curves, window))
+    sweep = {}
+    for k in k_range:
+        result = fit_trajectory_kmeans(curves, distances, k)
+        silhouette = silhouette_score(distances, result['labels'], metric='precomputed') if k > 1 else np.nan
+        sweep[k] = {**result, 'start': 'euclidean', 'silhouette': silhouette, 'silhouette_interval': None}
+    return sweep
+
+
+# Result-cache job of the trajectory k-sweep
+def trajectory_kmeans_sweep_job(values):
+    params = {'window': DTW_WINDOW, 'k_range': list(KMEANS_K_RANGE)}
+    return 'trajectory_kmeans_sweep', dataset_fingerprint(values), params, lambda: trajectory_kmeans_sweep(values)
+
+
+@st.cache_resource(show_spinner="Fitting DTW KMeans for every number of clusters...", max_entries=4)
+def _cached_trajectory_kmeans_sweep(fingerprint, _values):
+    return job_result(trajectory_kmeans_sweep_job(_values))
+
+
+# Trajectory k-sweep of a population cube, computed once per dataset and shared by every session and
+# page. Same layout as load_kmeans_sweep. Treat the result as read-only.
+def load_trajectory_kmeans_sweep(cube):
+    return _cached_trajectory_kmeans_sweep(dataset_fingerprint(cube['values']), cube['values'])
+
+
+# Cophenetic correlation coefficient of a hierarchy against the distances it was built from
+def cophenetic_correlation(tree, condensed):
+    return cophenet(tree, condensed)[0]
+
+
+# AHC for every k from one tree per method, built from condensed distances (linkage needs all of them
+# anyway, so the silhouettes use the full matrix too):
+# {method: {'tree', 'ccc', 'labels': {k: labels}, 'silhouette': {k: score}}}.
+# A single multi-level cut gives the same partitions as refitting AgglomerativeClustering for each k.
+def ahc_sweep(condensed, methods=AHC_LINKAGES, k_range=AHC_K_RANGE):
+    distances = square_distances(condensed)
+    sweep = {}
+    for method in methods:
+        tree = linkage(condensed, method=method)
+        cuts = cut_tree(tree, n_clusters=list(k_range))
+        labels = {k: cuts[:, column] for column, k in enumerate(k_range)}
+        sweep[method] = {
+            'tree': tree,
+            'ccc': cophenetic_correlation(tree, condensed),
+            'labels': labels,
+            'silhouette': {k: silhouette_score(distances, labels[k], metric='precomputed') for k in k_range},
+        }
+    return sweep
+
+
+# Result-cache job of the AHC sweep of values (condensed: their condensed distances, computed here when
+# None)
+def ahc_sweep_job(values, condensed=None):
+    params = {'methods': list(AHC_LINKAGES), 'k_range': list(AHC_K_RANGE)}
+
+    def compute():
+        return ahc_sweep(condensed_distances(values) if condensed is None else condensed)
+
+    return 'ahc_sweep', dataset_fingerprint(values), params, compute
+
+
+@st.cache_resource(show_spinner=False, max_entries=4)
+def _cached_ahc_sweep(fingerprint, _values, _condensed):
+    return job_result(ahc_sweep_job(_values, _condensed))
+
+
+# AHC sweep of a feature matrix over AHC_LINKAGES x AHC_K_RANGE, on its condensed distances (e.g.
+# utils.data.load_population_distances). Computed once per dataset and shared by every session. Treat
+# the result as read-only.
+def load_ahc_sweep(values, condensed=None):
+    return _cached_ahc_sweep(dataset_fingerprint(values), values, condensed)
+
+
+# Result-cache job of the cophenetic correlation of the single, average and complete trees over the
+# numeric columns of data: (ccc_single, ccc_average, ccc_complete)
+def ccc_job(data):
+    numeric_data = data.select_dtypes(include=['float64', 'int64'])
+
+    def compute():
+        # Condensed distances of these features (coordinates included, so not the population cube's),
+        # computed once and shared by the three linkages
+        distances = condensed_distances(numeric_data)
+        return tuple(cophenetic_correlation(linkage(distances, method=method), distances) for method in AHC_LINKAGES)
+
+    return 'ccc', dataset_fingerprint(numeric_data.to_numpy()), {'columns': list(numeric_data.columns)}, compute
+
+
+# scipy linkage matrix from a fitted sklearn tree (same node numbering: leaves 0..n-1, merge i is n + i)
+def _linkage_from_children(children, heights, n):
+    counts = np.ones(n + len(children))
+    for merge, (left, right) in enumerate(children):
+        counts[n + merge] = counts[left] + counts[right]
+    return np.column_stack([children, heights, counts[n:]]).astype(np.float64)
+
+
+# AHC where only clusters that share a border may merge: one connectivity-constrained tree per method,
+# cut for every k. Clusters are contiguous regions, and the fit only walks the edges of the adjacency
+# graph instead of all pairs. Same layout as ahc_sweep without 'ccc' (cophenetic distances of a
+# constrained tree say little about the data). distances (condensed) may be None on large inputs. With
+# metric='precomputed' values are square distances themselves.
+def spatial_ahc_sweep(values, connectivity, distances=None, methods=AHC_LINKAGES, k_range=AHC_K_RANGE, metric='euclidean'):
+    values = np.asarray(values)
+    distances = None if distances is None else square_distances(distances)
+    sweep = {}
+    for method in methods:
+        model = AgglomerativeClustering(
+            n_clusters=1, metric=metric, linkage=method, connectivity=connectivity, compute_full_tree=True,
+            compute_distances=True,
+        ).fit(values)
+        tree = _linkage_from_children(model.children_, model.distances_, len(values))
+        cuts = cut_tree(tree, n_clusters=list(k_range))
+        labels = {k: cuts[:, column] for column, k in enumerate(k_range)}
+        sweep[method] = {
+            'tree': tree,
+            'labels': labels,
+            'silhouette': {
+                k: estimate_silhouette(values, labels[k], distances, default_sample_size(len(values)))[0] for k in k_range
+            },
+        }
+    return sweep
+
+
+def _graph_fingerprint(connectivity):
+    return dataset_fingerprint(np.concatenate([connectivity.indptr, connectivity.indices]))
+
+
+# Result-cache job of the spatially constrained AHC sweep
+def spatial_ahc_sweep_job(values, connectivity, distances=None):
+    params = {'graph': _graph_fingerprint(connectivity), 'methods': list(AHC_LINKAGES), 'k_range': list(AHC_K_RANGE)}
+    return 'spatial_ahc_sweep', dataset_fingerprint(values), params, lambda: spatial_ahc_sweep(values, connectivity, distances)
+
+
+@st.cache_resource(show_spinner=False, max_entries=4)
+def _cached_spatial_ahc_sweep(fingerprint, graph_fingerprint, _values, _connectivity, _distances):
+    return job_result(spatial_ahc_sweep_job(_values, _connectivity, _distances))
+
+
+# Spatially constrained AHC sweep of a population cube (connectivity: CSR adjacency of its rows),
+# computed once per dataset and graph and shared by every session. Treat the result as read-only.
+def load_spatial_ahc_sweep(cube, connectivity, distances=None):
+    return _cached_spatial_ahc_sweep(
+        dataset_fingerprint(cube['values']), _graph_fingerprint(connectivity), cube['values'], connectivity, distances,
+    )
+
+
+# Result-cache job of the AHC sweep of growth curves under DTW, spatially constrained when a
+# connectivity graph is given
+def trajectory_ahc_sweep_job(values, connectivity=None):
+    curves = growth_curves(values)
+    params = {'window': DTW_WINDOW, 'methods': list(AHC_LINKAGES), 'k_range': list(AHC_K_RANGE)}
+    if connectivity is None:
+        return 'trajectory_ahc_sweep', dataset_fingerprint(values), params, lambda: ahc_sweep(dtw_distances(curves))
+
+    def compute():
+        condensed = dtw_distances(curves)
+        return spatial_ahc_sweep(square_distances(condensed), connectivity, condensed, metric='precomputed')
+
+    params['graph'] = _graph_fingerprint(connectivity)
+    return 'spatial_trajectory_ahc_sweep', dataset_fingerprint(values), params, compute
+
+
+@st.cache_resource(show_spinner=False, max_entries=4)
+def _cached_trajectory_ahc_sweep(fingerprint, graph_fingerprint, _values, _connectivity):
+    return job_result(trajectory_ahc_sweep_job(_values, _connectivity))
+
+
+# Trajectory AHC sweep of a population cube (spatially constrained with connectivity), computed once
+# per dataset and graph and shared by every session. Same layout as load_ahc_sweep and
+# load_spatial_ahc_sweep. Treat the result as read-only.
+def load_trajectory_ahc_sweep(cube, connectivity=None):
+    graph_fingerprint = None if connectivity is None else _graph_fingerprint(connectivity)
+    return _cached_trajectory_ahc_sweep(dataset_fingerprint(cube['values']), graph_fingerprint, cube['values'], connectivity)
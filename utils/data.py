@@ -0,0 +1,253 @@
+import hashlib
+import os
+
+import numpy as np
+import streamlit as st
+from scipy import sparse
+
+from utils.artifacts import artifact_path, is_fresh, open_npy_artifact, save_npy_artifact, save_npz_artifact
+from utils.distances import BLOCKWISE_MIN_ROWS, condensed_distances
+from utils.geo import (
+    GEOMETRY_ARTIFACT, TIER_ZOOMS, build_adjacency, build_desa_index, geometry_asset, geometry_geojson, read_geometry,
+    read_geometry_tier, select_tier, tier_artifact, write_static_file,
+)
+from utils.population import DATASET_ARTIFACT, desa_keys, melt_population, read_population, year_columns
+
+# Source files shared by every page. The wide population CSV is the single source of the
+# population data; the long layout is derived from it (the long CSV is only an export).
+GEOJSON_PATH = 'andy.geojson'
+POPULATION_WIDE_PATH = 'AUDIT-Data_Original_Update.csv'
+POPULATION_LONG_PATH = 'AUDIT_data_kab.pwk.csv'
+
+# Year x year correlation matrix of the wide table, updated incrementally when a year is ingested
+YEAR_CORRELATION_ARTIFACT = 'year_correlation.npz'
+
+# Clustering feature matrix and its condensed float32 Euclidean distances, stored as plain .npy files
+# so every server process memory-maps the same copy instead of building its own. The distances are only
+# built below BLOCKWISE_MIN_ROWS desa, larger datasets stream their distances instead.
+FEATURES_ARTIFACT = 'population_features.npy'
+DISTANCES_ARTIFACT = 'population_distances.condensed.npy'
+
+
+# Fingerprint of a source file, passed to the cached readers so an edited file invalidates its entry
+def source_stamp(path):
+    try:
+        stat = os.stat(path)
+    except FileNotFoundError:
+        return None
+    return stat.st_mtime_ns, stat.st_size
+
+
+# The readers below are parsed once per server process and the same object is handed
+# to every session, so callers must treat the result as read-only (copy before adding columns).
+@st.cache_resource(show_spinner=False, max_entries=2)
+def _read_geojson(path, stamp):
+    return read_geometry(path)
+
+
+@st.cache_resource(show_spinner=False, max_entries=2 * len(TIER_ZOOMS))
+def _read_geometry_tier(path, zoom, stamp):
+    return read_geometry_tier(path, zoom)
+
+
+@st.cache_resource(show_spinner=False, max_entries=2 * len(TIER_ZOOMS) + 2)
+def _geometry_asset_url(path, zoom, stamp):
+    content = geometry_geojson(load_geometry_tier(zoom, path) if zoom is not None else load_geojson(path))
+    name = geometry_asset(zoom)
+    write_static_file(name, content)
+    # The version parameter makes the browser keep the file until the polygons change
+    return f'app/static/{name}?v={hashlib.sha256(content).hexdigest()[:16]}'
+
+
+@st.cache_resource(show_spinner=False, max_entries=2)
+def _build_desa_index(path, stamp):
+    return build_desa_index(load_geojson(path))
+
+
+@st.cache_resource(show_spinner=False, max_entries=2)
+def _read_population(path, stamp):
+    return read_population(path)
+
+
+@st.cache_resource(show_spinner=False, max_entries=2)
+def _melt_population(path, stamp):
+    return melt_population(load_population_wide(path))
+
+
+@st.cache_resource(show_spinner=False, max_entries=2)
+def _pivot_population_by_year(path, stamp):
+    wide = load_population_wide(path)
+    years = year_columns(wide)
+    return wide[years].set_axis(desa_keys(wide)).set_axis([int(year) for year in years], axis=1)
+
+
+# The cube values come from the memory-mapped feature artifact when it is fresh
+@st.cache_resource(show_spinner=False, max_entries=2)
+def _build_population_cube(path, stamp):
+    cube = build_population_cube(load_population_wide(path))
+    features = open_npy_artifact(FEATURES_ARTIFACT, path)
+    if features is not None and features.shape == cube['values'].shape:
+        cube['values'] = features
+    return cube
+
+
+@st.cache_resource(show_spinner=False, max_entries=2)
+def _read_population_distances(path, stamp):
+    distances = open_npy_artifact(DISTANCES_ARTIFACT, path)
+    values = load_population_cube(path)['values']
+    if distances is None and len(values) < BLOCKWISE_MIN_ROWS:
+        distances = condensed_distances(values)
+        distances.flags.writeable = False
+    return distances
+
+
+@st.cache_resource(show_spinner=False, max_entries=2)
+def _build_population_adjacency(path, geojson_path, stamp):
+    return population_adjacency(load_population_wide(path), load_geojson(geojson_path))
+
+
+@st.cache_resource(show_spinner=False, max_entries=2)
+def _read_year_correlation(path, stamp):
+    return read_year_correlation(path)
+
+
+# Canonical desa x year feature store built from a wide population table:
+#   {'values': read-only C-contiguous float64 array (rows = desa, columns = years),
+#    'desa': row labels, 'years': column labels,
+#    'desa_index': {DESA_1: row} (first row per name), 'year_index': {year: column}}
+# Rows stay aligned with the wide table so results can be attached back to it.
+def build_population_cube(df):
+    years = year_columns(df)
+    values = np.ascontiguousarray(df[years].to_numpy(dtype=np.float64))
+    values.flags.writeable = False
+    desa = df['DESA_1'].tolist()
+    desa_index = {}
+    for row, name in enumerate(desa):
+        desa_index.setdefault(name, row)
+    return {
+        'values': values,
+        'desa': desa,
+        'years': years,
+        'desa_index': desa_index,
+        'year_index': {year: column for column, year in enumerate(years)},
+    }
+
+
+# Adjacency between the rows of a wide population table (CSR, rows aligned with the cube) from the
+# adjacency of their polygons. Desa names repeat across kecamatan, so rows and polygons are paired on
+# (DESA_1, KECAMATAN). Rows without a polygon have no neighbours.
+def population_adjacency(wide, gdf):
+    polygons = desa_keys(gdf).get_indexer(desa_keys(wide))
+    rows = np.flatnonzero(polygons >= 0)
+    selection = sparse.csr_matrix(
+        (np.ones(len(rows), dtype=bool), (rows, polygons[rows])), shape=(len(wide), len(gdf))
+    )
+    return (selection @ build_adjacency(gdf) @ selection.T).tocsr()
+
+
+# Build step: the cube values and their condensed distances as memory-mappable .npy files
+def build_features_artifact(source):
+    values = build_population_cube(read_population(source))['values']
+    paths = [save_npy_artifact(FEATURES_ARTIFACT, source, values)]
+    if len(values) < BLOCKWISE_MIN_ROWS:
+        paths.append(save_npy_artifact(DISTANCES_ARTIFACT, source, condensed_distances(values)))
+    return paths
+
+
+def year_correlation(values):
+    return np.corrcoef(values, rowvar=False)
+
+
+def save_year_correlation(years, correlation, source):
+    return save_npz_artifact(YEAR_CORRELATION_ARTIFACT, source, years=np.array(years), correlation=correlation)
+
+
+# Build step: correlation between the year columns of the wide table
+def build_year_correlation_artifact(source):
+    cube = build_population_cube(read_population(source))
+    return save_year_correlation(cube['years'], year_correlation(cube['values']), source)
+
+
+def read_year_correlation(source):
+    if is_fresh(YEAR_CORRELATION_ARTIFACT, source):
+        with np.load(artifact_path(YEAR_CORRELATION_ARTIFACT)) as artifact:
+            return artifact['correlation']
+    return year_correlation(load_population_cube(source)['values'])
+
+
+# Desa polygons from andy.geojson (served from the prebuilt GeoParquet artifact when it is fresh)
+def load_geojson(path=GEOJSON_PATH):
+    stamp = (source_stamp(path), source_stamp(artifact_path(GEOMETRY_ARTIFACT)))
+    return _read_geojson(path, stamp)
+
+
+# Desa polygons simplified for a map shown at the given zoom level
+def load_geometry_tier(zoom, path=GEOJSON_PATH):
+    tier = select_tier(zoom)
+    if tier is None:
+        return load_geojson(path)
+    stamp = (source_stamp(path), source_stamp(artifact_path(tier_artifact(tier))))
+    return _read_geometry_tier(path, tier, stamp)
+
+
+# URL of the polygons of load_geometry_tier(zoom) served as a static GeoJSON file, or None when the
+# server does not serve static files. A map given this URL as geojson sends its polygons to the
+# browser once, later figures only carry the locations (row positions of the tier) and their values.
+def geometry_asset_url(zoom, path=GEOJSON_PATH):
+    if not st.get_option('server.enableStaticServing'):
+        return None
+    tier = select_tier(zoom)
+    name = GEOMETRY_ARTIFACT if tier is None else tier_artifact(tier)
+    stamp = (source_stamp(path), source_stamp(artifact_path(name)))
+    return _geometry_asset_url(path, tier, stamp)
+
+
+# Centroid, bounding box and overall map center per desa, see utils.geo.build_desa_index
+def load_desa_index(path=GEOJSON_PATH):
+    stamp = (source_stamp(path), source_stamp(artifact_path(GEOMETRY_ARTIFACT)))
+    return _build_desa_index(path, stamp)
+
+
+def _population_stamp(path):
+    return source_stamp(path), source_stamp(artifact_path(DATASET_ARTIFACT))
+
+
+# Wide population table: one row per desa, one column per year (served from the validated dataset artifact when it is fresh)
+def load_population_wide(path=POPULATION_WIDE_PATH):
+    return _read_population(path, _population_stamp(path))
+
+
+# Shared population cube of the wide table, see build_population_cube
+def load_population_cube(path=POPULATION_WIDE_PATH):
+    stamp = (_population_stamp(path), source_stamp(artifact_path(FEATURES_ARTIFACT)))
+    return _build_population_cube(path, stamp)
+
+
+# Read-only condensed float32 Euclidean distances between the cube rows (memory-mapped when the artifact
+# is fresh), None from BLOCKWISE_MIN_ROWS desa on. The one distance store of the KMeans, AHC and
+# stability results; utils.distances.square_distances gives the square form.
+def load_population_distances(path=POPULATION_WIDE_PATH):
+    stamp = (_population_stamp(path), source_stamp(artifact_path(DISTANCES_ARTIFACT)))
+    return _read_population_distances(path, stamp)
+
+
+# Which desa rows share a border, see population_adjacency
+def load_population_adjacency(path=POPULATION_WIDE_PATH, geojson_path=GEOJSON_PATH):
+    stamp = (_population_stamp(path), source_stamp(geojson_path), source_stamp(artifact_path(GEOMETRY_ARTIFACT)))
+    return _build_population_adjacency(path, geojson_path, stamp)
+
+
+# Correlation between the year columns of the population cube (same order as cube['years'])
+def load_year_correlation(path=POPULATION_WIDE_PATH):
+    stamp = (_population_stamp(path), source_stamp(artifact_path(YEAR_CORRELATION_ARTIFACT)))
+    return _read_year_correlation(path, stamp)
+
+
+# Long population table: one row per (desa, year), melted from the wide table
+def load_population_long(path=POPULATION_WIDE_PATH):
+    return _melt_population(path, _population_stamp(path))
+
+
+# Population indexed by (DESA_1, KECAMATAN) (rows) and year (columns), joined to the geometry on the same key
+def load_population_by_year(path=POPULATION_WIDE_PATH):
+    return _pivot_population_by_year(path, _population_stamp(path))
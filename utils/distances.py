@@ -0,0 +1,94 @@
+import hashlib
+
+import numpy as np
+from scipy.spatial.distance import cdist, pdist, squareform
+from scipy.stats import norm
+from sklearn.metrics import silhouette_score
+
+# Distinct (feature set, metric) pairs kept at once; the least recently used one is dropped first
+DISTANCE_CACHE_SIZE = 8
+
+# From this many rows no full distance matrix is built: silhouettes stream the distances in row
+# blocks, and by default only SILHOUETTE_SAMPLE_SIZE random rows are scored
+BLOCKWISE_MIN_ROWS = 20000
+SILHOUETTE_SAMPLE_SIZE = 10000
+
+# Bytes one block of streamed distances may take
+DISTANCE_MEMORY_BUDGET = 256 * 2 ** 20
+
+
+# Content hash of a feature matrix, the memo key for results computed from it
+def dataset_fingerprint(values):
+    digest = hashlib.sha256(str(values.shape).encode())
+    digest.update(np.ascontiguousarray(values).tobytes())
+    return digest.hexdigest()
+
+
+# Condensed pairwise distances of the rows of values. float32 halves the memory; linkage, cophenet
+# and silhouette results match the float64 ones to ~1e-8. The population cube's are stored as an
+# artifact (see utils.data.load_population_distances).
+def condensed_distances(values, metric='euclidean'):
+    return pdist(np.asarray(values, dtype=np.float64), metric=metric).astype(np.float32)
+
+
+# Square form of condensed distances, the input of metric='precomputed' estimators
+def square_distances(condensed):
+    return squareform(condensed, checks=False)
+
+
+# (rows, distances from those rows to every row) in blocks of at most budget bytes
+def distance_blocks(values, rows=None, budget=DISTANCE_MEMORY_BUDGET):
+    values = np.asarray(values, dtype=np.float64)
+    rows = np.arange(len(values)) if rows is None else np.asarray(rows)
+    block_size = max(1, budget // (8 * len(values)))
+    for start in range(0, len(rows), block_size):
+        block = rows[start:start + block_size]
+        yield block, cdist(values[block], values)
+
+
+# Silhouette of the given rows (all by default) against the whole dataset. Only the per-cluster
+# distance sums of each block are kept, so memory stays within the budget whatever the row count.
+# Same conventions as sklearn: 0 for rows alone in their cluster.
+def blockwise_silhouette_samples(values, labels, rows=None, budget=DISTANCE_MEMORY_BUDGET):
+    _, labels = np.unique(labels, return_inverse=True)
+    counts = np.bincount(labels)
+    membership = np.zeros((len(labels), len(counts)))
+    membership[np.arange(len(labels)), labels] = 1
+    samples = []
+    for block, distances in distance_blocks(values, rows, budget):
+        sums = distances @ membership
+        own = labels[block]
+        positions = np.arange(len(block))
+        intra = sums[positions, own] / np.maximum(counts[own] - 1, 1)
+        sums[positions, own] = np.inf
+        nearest = (sums / counts).min(axis=1)
+        with np.errstate(invalid='ignore'):
+            scores = np.nan_to_num((nearest - intra) / np.maximum(intra, nearest))
+        samples.append(np.where(counts[own] > 1, scores, 0))
+    return np.concatenate(samples)
+
+
+# Rows to score for a silhouette of n rows: every row below BLOCKWISE_MIN_ROWS, a sample above
+def default_sample_size(n):
+    return SILHOUETTE_SAMPLE_SIZE if n >= BLOCKWISE_MIN_ROWS else None
+
+
+# Mean silhouette and its confidence interval (None when every row was scored). Below
+# BLOCKWISE_MIN_ROWS it is sklearn's score, on the precomputed square distances when given. Larger
+# inputs are scored blockwise; with sample_size only that many random rows are scored (each against
+# all rows) and the interval is the normal approximation for the sampled mean.
+def estimate_silhouette(values, labels, distances=None, sample_size=None, confidence=0.95, random_state=42):
+    n = len(labels)
+    if sample_size is None or sample_size >= n:
+        if n >= BLOCKWISE_MIN_ROWS:
+            return blockwise_silhouette_samples(values, labels).mean(), None
+        if distances is not None:
+            return silhouette_score(distances, labels, metric='precomputed'), None
+        return silhouette_score(values, labels), None
+
+    rows = np.random.default_rng(random_state).choice(n, size=sample_size, replace=False)
+    samples = blockwise_silhouette_samples(values, labels, rows)
+    finite_population = np.sqrt((n - sample_size) / (n - 1))
+    margin = norm.ppf(0.5 + confidence / 2) * samples.std(ddof=1) / np.sqrt(sample_size) * finite_population
+    score = samples.mean()
+    return score, (score - margin, score + margin)
@@ -0,0 +1,62 @@
+import hashlib
+import json
+import threading
+
+import numpy as np
+import pandas as pd
+import streamlit as st
+
+from utils.distances import dataset_fingerprint
+
+# Built figures kept at once; the least recently used one is dropped first
+FIGURE_CACHE_SIZE = 64
+
+# Requests and builds since the server started, over every session
+_figure_stats = {'requests': 0, 'builds': 0}
+_figure_stats_lock = threading.Lock()
+
+
+# Content hash of the data a figure is built from: DataFrames and Series by their values, index and
+# column names, arrays by their bytes
+def _data_fingerprint(data):
+    if isinstance(data, (pd.DataFrame, pd.Series)):
+        digest = hashlib.sha256(pd.util.hash_pandas_object(data, index=True).to_numpy().tobytes())
+        digest.update(repr(list(data.columns) if isinstance(data, pd.DataFrame) else data.name).encode())
+        return digest.hexdigest()
+    return dataset_fingerprint(np.asarray(data))
+
+
+# Cache key of a figure: its name, the data slices it is drawn from and its styling parameters
+def figure_key(name, *data, **params):
+    payload = json.dumps(
+        {'name': name, 'data': [_data_fingerprint(part) for part in data], 'params': params}, sort_keys=True, default=str,
+    )
+    return hashlib.sha256(payload.encode()).hexdigest()
+
+
+@st.cache_resource(show_spinner=False, max_entries=FIGURE_CACHE_SIZE)
+def _cached_figure(key, _build):
+    with _figure_stats_lock:
+        _figure_stats['builds'] += 1
+    return _build()
+
+
+# Figure built by build(), reused while the same data and parameters come back. Shared by every
+# session: treat it as read-only (st.plotly_chart only reads it), and pass everything the figure
+# depends on as data or params.
+def cached_figure(name, build, *data, **params):
+    with _figure_stats_lock:
+        _figure_stats['requests'] += 1
+    return _cached_figure(figure_key(name, *data, **params), build)
+
+
+# {'hits', 'misses'} of the figure cache since the server started
+def figure_cache_stats():
+    with _figure_stats_lock:
+        return {'hits': _figure_stats['requests'] - _figure_stats['builds'], 'misses': _figure_stats['builds']}
+
+
+# Sidebar line with the figure cache counts, shown at the end of a page run so it includes that run
+def show_figure_cache_stats():
+    stats = figure_cache_stats()
+    st.sidebar.caption(f"Cache grafik: {stats['hits']} hit, {stats['misses']} miss")
@@ -0,0 +1,159 @@
+import json
+import os
+
+import geopandas as gpd
+import numpy as np
+import pyarrow.parquet as pq
+import shapely
+from scipy import sparse
+
+from utils.artifacts import artifact_path, is_fresh, record_artifact
+
+# Only these attributes of andy.geojson are used by the app
+GEOMETRY_COLUMNS = ['DESA_1', 'KECAMATAN', 'ID2013', 'geometry']
+GEOMETRY_ARTIFACT = 'desa.parquet'
+
+# UTM zone 48S, a metric CRS covering Purwakarta, used for centroid computations
+PROJECTED_CRS = 'EPSG:32748'
+
+# Map zoom levels that get their own simplified copy of the polygons
+TIER_ZOOMS = (8, 9, 10, 12)
+
+# Folder Streamlit serves at app/static/ when server.enableStaticServing is on (.streamlit/config.toml)
+STATIC_DIR = 'static'
+
+
+# Keep the used columns and drop the constant 0.0 Z coordinate from every vertex
+def prepare_geometry(gdf):
+    gdf = gdf[GEOMETRY_COLUMNS].copy()
+    gdf['geometry'] = gpd.GeoSeries(shapely.force_2d(gdf.geometry.values), index=gdf.index, crs=gdf.crs)
+    return gdf
+
+
+def tier_artifact(zoom):
+    return f'desa_z{zoom}.parquet'
+
+
+# Static GeoJSON file of a zoom tier, None meaning full resolution
+def geometry_asset(zoom):
+    return 'desa.geojson' if zoom is None else f'desa_z{zoom}.geojson'
+
+
+# Half a screen pixel, in degrees, at a Mapbox zoom level (512 px tiles): simplifying
+# with this tolerance moves no vertex far enough to be visible at that zoom
+def zoom_tolerance(zoom):
+    return 360 / (512 * 2 ** zoom) / 2
+
+
+# Coarsest tier that is still detailed enough for the given zoom, None means full resolution
+def select_tier(zoom):
+    for tier in TIER_ZOOMS:
+        if tier >= zoom:
+            return tier
+    return None
+
+
+def simplify_geometry(gdf, zoom):
+    # Shared desa borders are simplified once for both neighbours, so the tiers stay gap-free
+    simplified = shapely.coverage_simplify(gdf.geometry.values, zoom_tolerance(zoom))
+    gdf = gdf.copy()
+    gdf['geometry'] = gpd.GeoSeries(simplified, index=gdf.index, crs=gdf.crs)
+    return gdf
+
+
+def _write_artifact(gdf, name, source):
+    path = artifact_path(name)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    gdf.to_parquet(path, index=False)
+    record_artifact(name, source)
+    return path
+
+
+# Build step: convert the GeoJSON source into a compact GeoParquet file
+def build_geometry_artifact(source):
+    return _write_artifact(prepare_geometry(gpd.read_file(source)), GEOMETRY_ARTIFACT, source)
+
+
+# Build step: one simplified GeoParquet file per zoom tier
+def build_tier_artifacts(source):
+    gdf = read_geometry(source)
+    return [_write_artifact(simplify_geometry(gdf, zoom), tier_artifact(zoom), source) for zoom in TIER_ZOOMS]
+
+
+# The polygons as a GeoJSON FeatureCollection, without attributes: feature ids are the row
+# positions of gdf, which is what the maps pass as locations
+def geometry_geojson(gdf):
+    return gdf.geometry.reset_index(drop=True).to_json().encode()
+
+
+# Write a file into STATIC_DIR unless it already holds the same content. Swapped in atomically, so
+# a browser fetching it meanwhile gets either the previous or the new version.
+def write_static_file(name, content):
+    path = os.path.join(STATIC_DIR, name)
+    try:
+        with open(path, 'rb') as f:
+            if f.read() == content:
+                return path
+    except FileNotFoundError:
+        pass
+    os.makedirs(STATIC_DIR, exist_ok=True)
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'wb') as f:
+        f.write(content)
+    os.replace(tmp_path, path)
+    return path
+
+
+# Read the GeoParquet artifact directly with pyarrow. gpd.read_parquet spends most of its time
+# parsing the PROJJSON CRS, so the CRS is rebuilt from its authority code when there is one.
+def _read_geoparquet(path):
+    table = pq.read_table(path)
+    geo = json.loads(table.schema.metadata[b'geo'])
+    column = geo['primary_column']
+    crs = geo['columns'][column].get('crs', 'EPSG:4326')
+    if isinstance(crs, dict) and 'id' in crs:
+        crs = f"{crs['id']['authority']}:{crs['id']['code']}"
+    geometry = shapely.from_wkb(table.column(column).to_numpy())
+    return gpd.GeoDataFrame(table.drop([column]).to_pandas(), geometry=geometry, crs=crs)[GEOMETRY_COLUMNS]
+
+
+# Prefer the prebuilt artifact, fall back to parsing the GeoJSON when it is missing or stale
+def read_geometry(source):
+    if is_fresh(GEOMETRY_ARTIFACT, source):
+        return _read_geoparquet(artifact_path(GEOMETRY_ARTIFACT))
+    return prepare_geometry(gpd.read_file(source))
+
+
+def read_geometry_tier(source, zoom):
+    if is_fresh(tier_artifact(zoom), source):
+        return _read_geoparquet(artifact_path(tier_artifact(zoom)))
+    return simplify_geometry(read_geometry(source), zoom)
+
+
+# Lookup of map positions built once per geometry load:
+#   {'center': {'lat', 'lon'}, 'desa': {DESA_1: {'lat', 'lon', 'bbox': (minx, miny, maxx, maxy)}}}
+# Centroids are computed in PROJECTED_CRS and converted back to lon/lat for plotting.
+# Desa names are not unique across kecamatan; the first polygon with a name wins, as in the maps before.
+def build_desa_index(gdf):
+    centroids = gdf.geometry.to_crs(PROJECTED_CRS).centroid
+    center = gpd.GeoSeries([shapely.Point(centroids.x.mean(), centroids.y.mean())], crs=PROJECTED_CRS).to_crs(gdf.crs)[0]
+    centroids = centroids.to_crs(gdf.crs)
+    bounds = gdf.geometry.bounds.to_numpy()
+
+    desa = {}
+    for name, lon, lat, bbox in zip(gdf['DESA_1'], centroids.x, centroids.y, bounds):
+        desa.setdefault(name, {'lat': lat, 'lon': lon, 'bbox': tuple(float(v) for v in bbox)})
+    return {'center': {'lat': center.y, 'lon': center.x}, 'desa': desa}
+
+
+# Polygon adjacency as a symmetric boolean CSR matrix over the rows of gdf: polygons that touch or
+# overlap (digitised borders rarely line up exactly). An STRtree query only tests polygons whose
+# bounding boxes meet instead of every pair.
+def build_adjacency(gdf):
+    geometries = np.asarray(gdf.geometry.values)
+    left, right = shapely.STRtree(geometries).query(geometries, predicate='intersects')
+    neighbours = left != right
+    adjacency = sparse.coo_matrix(
+        (np.ones(neighbours.sum(), dtype=bool), (left[neighbours], right[neighbours])), shape=(len(gdf), len(gdf))
+    )
+    return adjacency.tocsr()
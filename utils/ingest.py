@@ -0,0 +1,176 @@
+import argparse
+import datetime
+import json
+import os
+import time
+
+import numpy as np
+import pandas as pd
+
+from utils.artifacts import ARTIFACT_DIR, artifact_path, is_fresh, read_manifest
+from utils.clustering import (
+    KMEANS_ARTIFACT, build_kmeans_artifact, read_kmeans_centroids, save_kmeans_centroids, warm_start_kmeans,
+)
+from utils.data import (
+    GEOJSON_PATH, POPULATION_LONG_PATH, POPULATION_WIDE_PATH, YEAR_CORRELATION_ARTIFACT, build_features_artifact,
+    build_population_cube, build_year_correlation_artifact, save_year_correlation,
+)
+from utils.geo import read_geometry
+from utils.population import (
+    CSV_LINE_TERMINATOR, DESA_KEY, build_dataset_artifact, check_population, desa_keys, export_long_csv,
+    prepare_population, year_columns,
+)
+
+# One entry per ingested year: what was rewritten, updated incrementally, rebuilt, left stale and kept
+INGEST_LOG_PATH = os.path.join(ARTIFACT_DIR, 'ingest_log.json')
+
+
+# Population of the new year aligned to the rows of the wide table. Desa names repeat across
+# kecamatan, so rows are matched on (DESA_1, KECAMATAN).
+def align_new_year(wide, new):
+    if not {*DESA_KEY, 'population'} <= set(new.columns):
+        raise ValueError("new year file needs DESA_1, KECAMATAN and population columns")
+    if new['population'].isna().any() or (new['population'] < 0).any():
+        raise ValueError("new year population must be present and non-negative for every desa")
+
+    wide_keys = desa_keys(wide)
+    new_keys = desa_keys(new)
+    if new_keys.has_duplicates:
+        duplicates = sorted(set(new_keys[new_keys.duplicated()]))
+        raise ValueError(f"desa listed more than once in the new year file: {duplicates}")
+    population = pd.Series(new['population'].to_numpy(), index=new_keys)
+
+    missing = wide_keys.difference(new_keys)
+    extra = new_keys.difference(wide_keys)
+    if len(missing) or len(extra):
+        raise ValueError(
+            f"desa mismatch: missing {sorted(missing)}, unknown {sorted(extra)}"
+        )
+    return population.reindex(wide_keys).to_numpy()
+
+
+# New year column placed right after the last existing year, before Latitude/Longitude
+def append_year_wide(wide, year, population):
+    position = wide.columns.get_loc(year_columns(wide)[-1]) + 1
+    wide = wide.copy()
+    wide.insert(position, str(year), population)
+    return wide
+
+
+# Grow the year correlation matrix by one row/column instead of recomputing it
+def extend_year_correlation(correlation, values):
+    centered = values - values.mean(axis=0)
+    norms = np.sqrt((centered ** 2).sum(axis=0))
+    new_row = centered.T @ centered[:, -1] / (norms * norms[-1])
+    extended = np.empty((len(new_row), len(new_row)))
+    extended[:-1, :-1] = correlation
+    extended[-1, :] = new_row
+    extended[:, -1] = new_row
+    return extended
+
+
+# Write both CSVs to temporary files and swap them in once both are complete. The wide CSV is the
+# source of truth and goes last: until it is replaced the year is not ingested and can be retried.
+def _replace_sources(new_wide, wide_path, long_path):
+    wide_tmp, long_tmp = wide_path + '.tmp', long_path + '.tmp'
+    try:
+        new_wide.to_csv(wide_tmp, index=False, lineterminator=CSV_LINE_TERMINATOR)
+        export_long_csv(new_wide, long_tmp)
+    except BaseException:
+        for path in (wide_tmp, long_tmp):
+            if os.path.exists(path):
+                os.remove(path)
+        raise
+    os.replace(long_tmp, long_path)
+    os.replace(wide_tmp, wide_path)
+
+
+def _write_log(entry):
+    try:
+        with open(INGEST_LOG_PATH) as f:
+            log = json.load(f)
+    except (FileNotFoundError, json.JSONDecodeError):
+        log = []
+    log.append(entry)
+    os.makedirs(ARTIFACT_DIR, exist_ok=True)
+    with open(INGEST_LOG_PATH, 'w') as f:
+        json.dump(log, f, indent=2)
+
+
+# Append one census year to the wide dataset, re-export the long CSV from it and bring the derived artifacts up to date
+# without a cold rebuild. Returns (and logs) a report of what was invalidated: every list in it is
+# taken from the files this call wrote and the manifest entries it found.
+def ingest_year(year, new_path, wide_path=POPULATION_WIDE_PATH, long_path=POPULATION_LONG_PATH):
+    start = time.perf_counter()
+    year = str(year)
+    wide = prepare_population(pd.read_csv(wide_path))
+    years = year_columns(wide)
+    if year in years:
+        raise ValueError(f"year {year} is already in {wide_path}")
+    if int(year) <= int(years[-1]):
+        raise ValueError(f"year {year} must come after the last year in the data ({years[-1]})")
+
+    population = align_new_year(wide, pd.read_csv(new_path))
+    new_wide = append_year_wide(wide, year, population)
+    polygons = read_geometry(GEOJSON_PATH)
+    errors, _ = check_population(new_wide, polygons)
+    if errors:
+        raise ValueError(f"{wide_path} with year {year} would fail the consistency checks: {'; '.join(errors)}")
+    values = build_population_cube(new_wide)['values']
+
+    # Read the old artifacts while they still match the old CSV
+    centroids = read_kmeans_centroids(wide_path)
+    correlation = None
+    if is_fresh(YEAR_CORRELATION_ARTIFACT, wide_path):
+        with np.load(artifact_path(YEAR_CORRELATION_ARTIFACT)) as artifact:
+            correlation = artifact['correlation']
+    manifest = read_manifest()
+    derived = sorted(name for name, entry in manifest.items() if entry['source'] in (wide_path, long_path))
+    kept = sorted(name for name in manifest if name not in derived)
+
+    _replace_sources(new_wide, wide_path, long_path)
+
+    # The dataset artifact is a validated copy of the CSV and the memory-mapped features are a
+    # straight dump of the new cube, both are rebuilt rather than patched
+    rebuilt = [build_dataset_artifact(wide_path, polygons=polygons), *build_features_artifact(wide_path)]
+    updated = {}
+    if centroids is None:
+        rebuilt.append(build_kmeans_artifact(wide_path))
+    else:
+        models = {k: warm_start_kmeans(values, k_centroids) for k, k_centroids in centroids.items()}
+        save_kmeans_centroids(models, year_columns(new_wide), wide_path)
+        updated[KMEANS_ARTIFACT] = {f'k={k}': f'{model.n_iter_} iterations' for k, model in models.items()}
+    if correlation is None:
+        rebuilt.append(build_year_correlation_artifact(wide_path))
+    else:
+        save_year_correlation(year_columns(new_wide), extend_year_correlation(correlation, values), wide_path)
+        updated[YEAR_CORRELATION_ARTIFACT] = 'added one row and column'
+    rebuilt = [os.path.basename(path) for path in rebuilt]
+
+    report = {
+        'year': year,
+        'ingested_at': datetime.datetime.now().isoformat(timespec='seconds'),
+        'rows': len(wide),
+        # in-process caches keyed on these files' mtime/size reload on the next rerun
+        'rewritten': [wide_path, long_path],
+        # artifacts built from the old sources that were neither rebuilt nor updated, stale until the next build
+        'invalidated': [name for name in derived if name not in rebuilt and name not in updated],
+        'updated_incrementally': updated,
+        'rebuilt': rebuilt,
+        'kept': kept,
+        'seconds': round(time.perf_counter() - start, 3),
+    }
+    _write_log(report)
+    return report
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Append a census year to the population datasets.')
+    parser.add_argument('year', help='year being added, e.g. 2024')
+    parser.add_argument('path', help='CSV with DESA_1, KECAMATAN and population columns for that year')
+    args = parser.parse_args(argv)
+    print(json.dumps(ingest_year(args.year, args.path), indent=2))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,21 @@
+from contextlib import contextmanager
+
+import streamlit as st
+
+
+# Expander whose body only runs once the user asks for it. Streamlit runs the body of every expander
+# on each rerun, open or not, so the body sits behind a toggle: use as
+#     with lazy_expander(label, key) as opened:
+#         if opened:
+#             ...
+# The toggle keeps its state for the session, and the expander stays open while it is on.
+@contextmanager
+def lazy_expander(label, key, toggle_label="Tampilkan"):
+    with st.expander(label, expanded=st.session_state.get(key, False)):
+        yield st.toggle(toggle_label, key=key)
+
+
+# Tabs of which only the selected one runs. st.tabs runs every tab on each rerun, these are a
+# horizontal radio instead: returns the selected label, the page renders that section only.
+def lazy_tabs(labels, key):
+    return st.radio("Bagian", labels, horizontal=True, key=key, label_visibility="collapsed")
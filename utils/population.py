@@ -0,0 +1,127 @@
+import os
+
+import numpy as np
+import pandas as pd
+
+from utils.artifacts import artifact_path, is_fresh, record_artifact
+
+# Bump when the layout or typing of the dataset artifact changes; the name changes with it,
+# so an artifact written by an older pipeline is never picked up
+DATASET_VERSION = 2
+DATASET_ARTIFACT = f'population.v{DATASET_VERSION}.parquet'
+
+# A value below this fraction of its desa's median is taken as a lost thousands separator
+# (3.200 read as a float and stored as 32), not as a real drop in population
+MAGNITUDE_DRIFT_RATIO = 0.2
+
+# The CSVs use Windows line endings, keep them when rewriting
+CSV_LINE_TERMINATOR = '\r\n'
+
+# Columns identifying a desa. Desa names repeat across kecamatan, so population rows and map
+# polygons are joined on the name together with its kecamatan.
+DESA_KEY = ['DESA_1', 'KECAMATAN']
+
+
+# Year columns of a wide population table, taken from the data instead of a hard-coded list
+def year_columns(df):
+    return [column for column in df.columns if str(column).isdigit()]
+
+
+# (DESA_1, KECAMATAN) of every row as an index, to join population rows and polygons on
+def desa_keys(df):
+    return pd.MultiIndex.from_frame(df[DESA_KEY])
+
+
+# Year columns holding whole numbers become int64, so float-formatted copies (1801.0) load the same
+def prepare_population(df):
+    df = df.copy()
+    years = year_columns(df)
+    values = df[years]
+    if values.notna().all().all() and (values % 1 == 0).all().all():
+        df[years] = values.astype('int64')
+    return df
+
+
+# Long layout (DESA_1, year, population), year-major like the original long CSV
+def melt_population(wide):
+    long = wide.melt(id_vars='DESA_1', value_vars=year_columns(wide), var_name='year', value_name='population')
+    long['year'] = long['year'].astype('int64')
+    return long
+
+
+# Write the long layout as CSV for the notebooks and other consumers; the app never reads it back
+def export_long_csv(wide, path):
+    melt_population(wide).to_csv(path, index_label='Unnamed:0', lineterminator=CSV_LINE_TERMINATOR)
+
+
+def _examples(wide, years, mask, limit=3):
+    rows, columns = np.nonzero(mask)
+    return ', '.join(f"{wide['DESA_1'].iat[r]} {years[c]}" for r, c in zip(rows[:limit], columns[:limit]))
+
+
+# Vectorised consistency checks over the whole table, returns (errors, warnings).
+# polygons, when given, are the map polygons (a frame with the DESA_KEY columns).
+def check_population(wide, polygons=None):
+    errors, warnings = [], []
+    if not set(DESA_KEY) <= set(wide.columns):
+        return [f"missing desa key column(s): {', '.join(sorted(set(DESA_KEY) - set(wide.columns)))}"], warnings
+    years = year_columns(wide)
+    values = wide[years].to_numpy(dtype=np.float64)
+
+    missing = np.isnan(values)
+    if missing.any():
+        errors.append(f'{missing.sum()} missing population values ({_examples(wide, years, missing)})')
+    negative = values < 0
+    if negative.any():
+        errors.append(f'{negative.sum()} negative population values ({_examples(wide, years, negative)})')
+    fractional = ~missing & (values % 1 != 0)
+    if fractional.any():
+        errors.append(f'{fractional.sum()} non-integer population values ({_examples(wide, years, fractional)})')
+    with np.errstate(divide='ignore', invalid='ignore'):
+        scaled = values / np.nanmedian(values, axis=1, keepdims=True)
+    drifted = ~missing & (scaled < MAGNITUDE_DRIFT_RATIO)
+    if drifted.any():
+        errors.append(f'{drifted.sum()} values an order of magnitude below their desa median, '
+                      f'likely float/int drift ({_examples(wide, years, drifted)})')
+
+    year_numbers = np.array(years, dtype=np.int64)
+    if len(year_numbers) and (np.diff(year_numbers) != 1).any():
+        gaps = sorted(set(range(year_numbers.min(), year_numbers.max() + 1)) - set(year_numbers))
+        warnings.append(f"year gaps: {', '.join(map(str, gaps)) or 'columns out of order'}")
+
+    no_kecamatan = wide['KECAMATAN'].isna()
+    if no_kecamatan.any():
+        errors.append(f"{no_kecamatan.sum()} desa without a kecamatan ({', '.join(wide['DESA_1'][no_kecamatan][:3])})")
+    keys = desa_keys(wide)
+    if keys.has_duplicates:
+        errors.append(f"desa listed more than once in the same kecamatan: "
+                      f"{', '.join(sorted(f'{name} ({kecamatan})' for name, kecamatan in keys[keys.duplicated()]))}")
+    if polygons is not None:
+        polygon_keys = desa_keys(polygons)
+        without_data = sorted(f'{name} ({kecamatan})' for name, kecamatan in polygon_keys.difference(keys))
+        without_polygon = sorted(f'{name} ({kecamatan})' for name, kecamatan in keys.difference(polygon_keys))
+        if without_data:
+            warnings.append(f"polygons without population data: {', '.join(without_data)}")
+        if without_polygon:
+            warnings.append(f"desa without a polygon: {', '.join(without_polygon)}")
+    return errors, warnings
+
+
+# Build step: validate the wide CSV and store it as the typed, versioned dataset the app loads
+def build_dataset_artifact(source, polygons=None):
+    wide = prepare_population(pd.read_csv(source))
+    errors, warnings = check_population(wide, polygons)
+    if errors:
+        raise ValueError(f"{source} failed the consistency checks: {'; '.join(errors)}")
+    path = artifact_path(DATASET_ARTIFACT)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    wide.to_parquet(path, index=False)
+    record_artifact(DATASET_ARTIFACT, source, version=DATASET_VERSION, warnings=warnings)
+    return path
+
+
+# Prefer the validated artifact, fall back to the CSV when it is missing or stale
+def read_population(source):
+    if is_fresh(DATASET_ARTIFACT, source):
+        return pd.read_parquet(artifact_path(DATASET_ARTIFACT))
+    return prepare_population(pd.read_csv(source))
@@ -0,0 +1,20 @@
+import streamlit as st
+
+
+# Progress bar over a page's loading stages. Shows the first stage and returns advance(): call it each
+# time a stage finishes, the bar then moves on to the next stage and is removed after the last one.
+# Stages served from the caches finish at once, so on reruns the bar is gone before it is drawn.
+def stage_progress(stages):
+    stages = list(stages)
+    bar = st.progress(0, text=stages[0])
+    done = 0
+
+    def advance():
+        nonlocal done
+        done += 1
+        if done < len(stages):
+            bar.progress(done / len(stages), text=stages[done])
+        else:
+            bar.empty()
+
+    return advance
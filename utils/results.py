@@ -0,0 +1,95 @@
+import hashlib
+import json
+import os
+import pickle
+
+import joblib
+
+from utils.artifacts import ARTIFACT_DIR
+
+# Clustering results kept on disk between server restarts and shared by every process and session,
+# one joblib file per (algorithm, dataset fingerprint, parameters)
+RESULT_CACHE_DIR = os.path.join(ARTIFACT_DIR, 'results')
+
+# Total size the result files may take; the least recently used ones are removed beyond it
+RESULT_CACHE_MAX_BYTES = 256 * 2 ** 20
+
+# Bump when a cached algorithm changes its output, so results of the old code are never served
+RESULT_CACHE_VERSION = 1
+
+
+def result_key(algorithm, fingerprint, **params):
+    payload = json.dumps(
+        {'version': RESULT_CACHE_VERSION, 'algorithm': algorithm, 'fingerprint': fingerprint, 'params': params},
+        sort_keys=True, default=str,
+    )
+    return hashlib.sha256(payload.encode()).hexdigest()
+
+
+def _result_path(key):
+    return os.path.join(RESULT_CACHE_DIR, f'{key}.joblib')
+
+
+# Stored result or None. A hit refreshes the file's mtime, which is what eviction goes by; a file that
+# is unreadable (or removed by another process meanwhile) counts as a miss.
+def load_result(key):
+    path = _result_path(key)
+    try:
+        result = joblib.load(path)
+        os.utime(path)
+    except (OSError, EOFError, ValueError, pickle.UnpicklingError):
+        return None
+    return result
+
+
+# Written to a temporary file and renamed, so readers in other processes never see half a result
+def store_result(key, result):
+    os.makedirs(RESULT_CACHE_DIR, exist_ok=True)
+    path = _result_path(key)
+    tmp_path = f'{path}.{os.getpid()}.tmp'
+    joblib.dump(result, tmp_path)
+    os.replace(tmp_path, path)
+    evict_results()
+
+
+# Remove the least recently used results until the cache fits in max_bytes
+def evict_results(max_bytes=RESULT_CACHE_MAX_BYTES):
+    entries = []
+    for entry in os.scandir(RESULT_CACHE_DIR):
+        if entry.name.endswith('.joblib'):
+            try:
+                stat = entry.stat()
+            except FileNotFoundError:
+                continue
+            entries.append((stat.st_mtime, stat.st_size, entry.path))
+    total = sum(size for _, size, _ in entries)
+    for _, size, path in sorted(entries):
+        if total <= max_bytes:
+            break
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+        total -= size
+
+
+# compute() once per (algorithm, fingerprint, params) across restarts, processes and users
+def cached_result(algorithm, fingerprint, compute, **params):
+    key = result_key(algorithm, fingerprint, **params)
+    result = load_result(key)
+    if result is None:
+        result = compute()
+        store_result(key, result)
+    return result
+
+
+# A job is an (algorithm, fingerprint, params, compute) tuple describing one cacheable result, so the
+# same result can be looked up by the pages and precomputed by utils.warmup
+def job_result(job):
+    algorithm, fingerprint, params, compute = job
+    return cached_result(algorithm, fingerprint, compute, **params)
+
+
+def job_is_cached(job):
+    algorithm, fingerprint, params, _ = job
+    return os.path.exists(_result_path(result_key(algorithm, fingerprint, **params)))
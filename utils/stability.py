@@ -0,0 +1,166 @@
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import streamlit as st
+from scipy.cluster.hierarchy import linkage
+from scipy.optimize import linear_sum_assignment
+from sklearn.cluster import KMeans
+
+from utils.clustering import AHC_K_RANGE, AHC_LINKAGES, KMEANS_K_RANGE
+from utils.distances import condensed_distances, dataset_fingerprint, square_distances
+from utils.results import job_result
+
+# Bootstrap resamples of the desa set per stability analysis, and the seed they are drawn from
+STABILITY_RESAMPLES = 200
+STABILITY_SEED = 42
+
+# Cluster counts the stability is reported for: every k the pages offer (k = 1 is trivially stable)
+STABILITY_KMEANS_K = [k for k in KMEANS_K_RANGE if k > 1]
+STABILITY_AHC_K = list(AHC_K_RANGE)
+
+
+# Adjusted Rand index from a contingency table, the same value as sklearn's adjusted_rand_score
+def _ari(contingency):
+    n = contingency.sum()
+    pairs = (contingency * (contingency - 1)).sum() / 2
+    rows = (contingency.sum(axis=1) * (contingency.sum(axis=1) - 1)).sum() / 2
+    columns = (contingency.sum(axis=0) * (contingency.sum(axis=0) - 1)).sum() / 2
+    expected = rows * columns / (n * (n - 1) / 2)
+    maximum = (rows + columns) / 2
+    return 1.0 if maximum == expected else (pairs - expected) / (maximum - expected)
+
+
+# {k: partition of the leaves} of a linkage tree with n leaves, by replaying its merges once; the same
+# partitions as cut_tree (up to the cluster numbering) without its per-node Python tree walk
+def _cut_partitions(tree, n, ks):
+    labels = np.arange(n)
+    members = {leaf: [leaf] for leaf in range(n)}
+    steps = {n - k: k for k in ks}
+    partitions = {}
+    if 0 in steps:
+        partitions[steps[0]] = labels.copy()
+    for merge, (left, right) in enumerate(tree[:, :2].astype(int), start=1):
+        joined = members.pop(left) + members.pop(right)
+        members[n + merge - 1] = joined
+        labels[joined] = n + merge - 1
+        if merge in steps:
+            partitions[steps[merge]] = labels.copy()
+    return partitions
+
+
+# (ARI, rows that landed in their reference cluster) of a resample clustering against the reference
+# labels of the same rows; resample clusters are matched to reference clusters one to one
+def _compare(reference, labels):
+    _, reference = np.unique(reference, return_inverse=True)
+    _, labels = np.unique(labels, return_inverse=True)
+    contingency = np.zeros((reference.max() + 1, labels.max() + 1))
+    np.add.at(contingency, (reference, labels), 1)
+    matched_reference, matched_labels = linear_sum_assignment(contingency, maximize=True)
+    mapping = np.full(contingency.shape[1], -1)
+    mapping[matched_labels] = matched_reference
+    return _ari(contingency), mapping[labels] == reference
+
+
+# Runs in a worker process: ARI sums and per-row match counts of a chunk of resamples, see
+# bootstrap_stability. The resample distances are taken from the full condensed matrix.
+def _bootstrap_chunk(values, condensed, references, seeds):
+    n = len(values)
+    distances = square_distances(condensed)
+    appearances = np.zeros(n)
+    ari = {engine: {k: 0.0 for k in ks} for engine, ks in references.items()}
+    matches = {engine: {k: np.zeros(n) for k in ks} for engine, ks in references.items()}
+    for seed in seeds:
+        sample = np.random.default_rng(seed).integers(n, size=n)
+        # A row drawn several times is one desa: it is compared once, at its first draw
+        rows, first = np.unique(sample, return_index=True)
+        appearances[rows] += 1
+        partitions = {}
+        if 'kmeans' in references:
+            partitions['kmeans'] = {
+                k: KMeans(n_clusters=k, n_init=1, random_state=seed).fit(values[sample]).labels_[first]
+                for k in references['kmeans']
+            }
+        methods = [engine for engine in references if engine != 'kmeans']
+        sample_condensed = square_distances(distances[np.ix_(sample, sample)]) if methods else None
+        for method in methods:
+            cuts = _cut_partitions(linkage(sample_condensed, method=method), n, references[method])
+            partitions[method] = {k: labels[first] for k, labels in cuts.items()}
+        for engine, labels in partitions.items():
+            for k, k_labels in labels.items():
+                k_ari, matched = _compare(references[engine][k][rows], k_labels)
+                ari[engine][k] += k_ari
+                matches[engine][k][rows[matched]] += 1
+    return appearances, ari, matches
+
+
+# Bootstrap stability of KMeans and AHC: resamples of the rows drawn with replacement are clustered
+# again with every k and compared with the reference partitions of the full data.
+# references: {'kmeans' or linkage method: {k: labels}}. Returns
+# {engine: {'ari': {k: mean ARI against the reference}, 'confidence': {k: per-row share of the resamples
+# containing the row that put it in its reference cluster}}}. The resamples are spread over a process
+# pool; spawned workers because the Streamlit server is multi-threaded.
+def bootstrap_stability(values, condensed, references, resamples=STABILITY_RESAMPLES, seed=STABILITY_SEED, workers=None):
+    values, condensed = np.asarray(values), np.asarray(condensed)
+    seeds = np.random.SeedSequence(seed).generate_state(resamples).tolist()
+    workers = min(workers or os.cpu_count() or 1, resamples)
+    if workers == 1:
+        chunks = [_bootstrap_chunk(values, condensed, references, seeds)]
+    else:
+        with ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context('spawn')) as pool:
+            futures = [
+                pool.submit(_bootstrap_chunk, values, condensed, references, chunk)
+                for chunk in np.array_split(seeds, workers)
+            ]
+            chunks = [future.result() for future in futures]
+
+    appearances = sum(chunk[0] for chunk in chunks)
+    with np.errstate(invalid='ignore'):
+        return {
+            engine: {
+                'ari': {k: sum(chunk[1][engine][k] for chunk in chunks) / resamples for k in ks},
+                'confidence': {k: sum(chunk[2][engine][k] for chunk in chunks) / appearances for k in ks},
+            }
+            for engine, ks in references.items()
+        }
+
+
+# Result-cache job of the stability of values' partitions in references ({engine: {k: labels}});
+# condensed: the condensed distances of values, computed here when None
+def stability_job(values, references, condensed=None):
+    reference_fingerprint = dataset_fingerprint(
+        np.concatenate([labels for engine in references.values() for labels in engine.values()])
+    )
+    params = {
+        'engines': list(references), 'resamples': STABILITY_RESAMPLES, 'seed': STABILITY_SEED,
+        'references': reference_fingerprint,
+    }
+
+    def compute():
+        return bootstrap_stability(values, condensed_distances(values) if condensed is None else condensed, references)
+
+    return 'stability', dataset_fingerprint(values), params, compute
+
+
+# References of the KMeans page (a k-sweep as returned by load_kmeans_sweep) and of the AHC page (a sweep
+# as returned by load_ahc_sweep)
+def kmeans_references(kmeans_sweep):
+    return {'kmeans': {k: kmeans_sweep[k]['labels'] for k in STABILITY_KMEANS_K}}
+
+
+def ahc_references(ahc_sweep):
+    return {method: {k: ahc_sweep[method]['labels'][k] for k in STABILITY_AHC_K} for method in AHC_LINKAGES}
+
+
+@st.cache_resource(show_spinner="Resampling desa for cluster stability...", max_entries=8)
+def _cached_stability(fingerprint, reference_fingerprint, _values, _references, _condensed):
+    return job_result(stability_job(_values, _references, _condensed))
+
+
+# Bootstrap stability of the given partitions of a population cube (see kmeans_references and
+# ahc_references), on the cube's condensed distances (see utils.data.load_population_distances).
+# Computed once per dataset and partitions and shared by every session. Treat the result as read-only.
+def load_stability(cube, references, condensed=None):
+    _, fingerprint, params, _ = stability_job(cube['values'], references)
+    return _cached_stability(fingerprint, params['references'], cube['values'], references, condensed)
@@ -0,0 +1,56 @@
+import numpy as np
+import streamlit as st
+
+from utils.distances import DISTANCE_CACHE_SIZE, DISTANCE_MEMORY_BUDGET, dataset_fingerprint
+
+# Sakoe-Chiba band of the DTW distance: a year is matched with years at most this far from it
+DTW_WINDOW = 2
+
+
+# Growth curve of every row: the yearly series z-normalised, so rows compare by the shape of their
+# trajectory rather than by their size. Constant rows become all zeros.
+def growth_curves(values):
+    values = np.asarray(values, dtype=np.float64)
+    centered = values - values.mean(axis=1, keepdims=True)
+    scale = values.std(axis=1, keepdims=True)
+    return np.divide(centered, scale, out=np.zeros_like(centered), where=scale > 0)
+
+
+# DTW distance between row i of a and row i of b, every pair at once: the dynamic programme walks the
+# band one cell at a time, each step vectorized over all pairs, keeping only two rows of the table
+def dtw(a, b, window=DTW_WINDOW):
+    a, b = np.atleast_2d(a), np.atleast_2d(b)
+    length = a.shape[1]
+    previous = np.full((len(a), length + 1), np.inf)
+    previous[:, 0] = 0
+    for i in range(1, length + 1):
+        current = np.full_like(previous, np.inf)
+        for j in range(max(1, i - window), min(length, i + window) + 1):
+            best = np.minimum(np.minimum(previous[:, j], current[:, j - 1]), previous[:, j - 1])
+            current[:, j] = (a[:, i - 1] - b[:, j - 1]) ** 2 + best
+        previous = current
+    return np.sqrt(previous[:, length])
+
+
+# Pairs evaluated per dtw() call so its tables stay within budget bytes
+def _pair_block_size(length, budget=DISTANCE_MEMORY_BUDGET):
+    return max(1, budget // (8 * 4 * (length + 1)))
+
+
+@st.cache_resource(show_spinner=False, max_entries=DISTANCE_CACHE_SIZE)
+def _dtw_distances(fingerprint, window, _curves):
+    rows, columns = np.triu_indices(len(_curves), k=1)
+    distances = np.empty(len(rows), dtype=np.float32)
+    block_size = _pair_block_size(_curves.shape[1])
+    for start in range(0, len(rows), block_size):
+        block = slice(start, start + block_size)
+        distances[block] = dtw(_curves[rows[block]], _curves[columns[block]], window)
+    distances.flags.writeable = False
+    return distances
+
+
+# Condensed pairwise DTW distances of the rows of curves, computed once per curve set and window and
+# shared by every session. Same layout as utils.distances.condensed_distances. Read-only.
+def dtw_distances(curves, window=DTW_WINDOW):
+    curves = np.asarray(curves, dtype=np.float64)
+    return _dtw_distances(dataset_fingerprint(curves), window, curves)
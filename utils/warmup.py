@@ -0,0 +1,129 @@
+import argparse
+import multiprocessing
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+from utils.clustering import (
+    ahc_sweep_job, ccc_job, kmeans_sweep_job, spatial_ahc_sweep_job,
+    trajectory_ahc_sweep_job, trajectory_kmeans_sweep_job,
+)
+from utils.data import (
+    POPULATION_WIDE_PATH, load_population_adjacency, load_population_cube, load_population_distances, load_population_wide,
+)
+from utils.results import job_is_cached, job_result, result_key, store_result
+from utils.stability import ahc_references, kmeans_references, stability_job
+
+
+# Every result-cache job a page can ask for. The year selectors only pick columns of results computed
+# for all years, and the cluster count/linkage sliders index into the sweeps, so these cover every
+# widget combination.
+def _kmeans_job(backend):
+    return kmeans_sweep_job(load_population_cube()['values'], load_population_distances(), backend, POPULATION_WIDE_PATH)
+
+
+def _ahc_job():
+    return ahc_sweep_job(load_population_cube()['values'], load_population_distances())
+
+
+def _spatial_ahc_job():
+    return spatial_ahc_sweep_job(load_population_cube()['values'], load_population_adjacency(), load_population_distances())
+
+
+def _trajectory_ahc_job(spatial):
+    return trajectory_ahc_sweep_job(load_population_cube()['values'], load_population_adjacency() if spatial else None)
+
+
+def _ccc_job():
+    return ccc_job(load_population_wide())
+
+
+# Stability of the partitions of another job, built from its cached result
+def _stability_job(job, references):
+    return stability_job(load_population_cube()['values'], references(job_result(job())), load_population_distances())
+
+
+WARMUP_JOBS = {
+    'kmeans_full': lambda: _kmeans_job('full'),
+    'kmeans_minibatch': lambda: _kmeans_job('minibatch'),
+    'ahc': _ahc_job,
+    'spatial_ahc': _spatial_ahc_job,
+    'trajectory_kmeans': lambda: trajectory_kmeans_sweep_job(load_population_cube()['values']),
+    'trajectory_ahc': lambda: _trajectory_ahc_job(False),
+    'spatial_trajectory_ahc': lambda: _trajectory_ahc_job(True),
+    'ccc': _ccc_job,
+    'kmeans_full_stability': lambda: _stability_job(lambda: _kmeans_job('full'), kmeans_references),
+    'kmeans_minibatch_stability': lambda: _stability_job(lambda: _kmeans_job('minibatch'), kmeans_references),
+    'ahc_stability': lambda: _stability_job(_ahc_job, ahc_references),
+}
+
+# Jobs whose inputs are results of the other jobs, run once those are in the cache
+WARMUP_LATE_JOBS = {'kmeans_full_stability', 'kmeans_minibatch_stability', 'ahc_stability'}
+
+
+# Runs in a worker process: compute one job into the result cache (replacing the stored result when
+# force), returns its duration
+def _warm(name, force=False):
+    start = time.perf_counter()
+    job = WARMUP_JOBS[name]()
+    if force:
+        algorithm, fingerprint, params, compute = job
+        store_result(result_key(algorithm, fingerprint, **params), compute())
+    else:
+        job_result(job)
+    return time.perf_counter() - start
+
+
+def _warm_all(names, force, workers, report):
+    pending = []
+    for name in names:
+        if force or not job_is_cached(WARMUP_JOBS[name]()):
+            pending.append(name)
+        else:
+            report[name] = None
+    if not pending:
+        return
+
+    workers = min(workers or os.cpu_count() or 1, len(pending))
+    if workers == 1:
+        for name in pending:
+            report[name] = _warm(name, force)
+        return
+    # spawn: the workers import utils afresh instead of inheriting Streamlit state from a fork
+    with ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context('spawn')) as pool:
+        futures = {pool.submit(_warm, name, force): name for name in pending}
+        for future in as_completed(futures):
+            report[futures[future]] = future.result()
+
+
+# Fill the result cache so no page request waits on a fit. Jobs already cached are skipped unless
+# force; the rest run in a process pool, WARMUP_LATE_JOBS after the others. Returns {job name:
+# seconds, or None when skipped}.
+def warm_results(names=None, force=False, workers=None):
+    names = list(names or WARMUP_JOBS)
+    report = {}
+    _warm_all([name for name in names if name not in WARMUP_LATE_JOBS], force, workers, report)
+    _warm_all([name for name in names if name in WARMUP_LATE_JOBS], force, workers, report)
+    return report
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Precompute every clustering result the app can request.')
+    parser.add_argument('jobs', nargs='*', help=f"jobs to run, any of {', '.join(WARMUP_JOBS)} (default: all)")
+    parser.add_argument('--force', action='store_true', help='recompute even if the result is cached')
+    parser.add_argument('--workers', type=int, help='worker processes (default: one per CPU)')
+    args = parser.parse_args(argv)
+    unknown = set(args.jobs) - set(WARMUP_JOBS)
+    if unknown:
+        parser.error(f"unknown job(s): {', '.join(sorted(unknown))}")
+
+    start = time.perf_counter()
+    report = warm_results(args.jobs, force=args.force, workers=args.workers)
+    for name in args.jobs or WARMUP_JOBS:
+        seconds = report[name]
+        print(f'{name}: up to date' if seconds is None else f'{name}: computed in {seconds:.2f}s')
+    print(f'warm-up finished in {time.perf_counter() - start:.2f}s')
+
+
+if __name__ == '__main__':
+    main()